@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+import math
+import queue
+import threading
+import time
+from collections import deque
+
+
+class QueueFull(Exception):
+    """Raised by StageQueue.run when its queue is full; retry_after is a wait estimate in seconds."""
+
+    def __init__(self, stage: str, retry_after: int):
+        super().__init__(f"{stage} queue is full")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class StageQueue:
+    """
+    Bounded priority queue in front of a stage served by `workers` threads.
+    Normal jobs are rejected with QueueFull once `max_waiting` are queued;
+    fast-lane jobs have their own `fast_max_waiting` bound and are always
+    dequeued before normal ones, so cheap work never waits behind a backlog.
+    Workers start in start(), so a queue built before fork() runs in the child.
+    """
+
+    FAST, NORMAL = 0, 1
+
+    def __init__(self, name: str, workers: int, max_waiting: int, fast_max_waiting: int):
+        self.name = name
+        self.workers = workers
+        self.limits = {self.FAST: fast_max_waiting, self.NORMAL: max_waiting}
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._waiting = {self.FAST: 0, self.NORMAL: 0}
+        self._running = 0
+        self._service_s = 0.0  # moving average of job run time
+        self._waits_ms: deque[float] = deque(maxlen=2048)
+        self.completed = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True).start()
+
+    def _work(self) -> None:
+        while True:
+            _, _, lane, enqueued, loop, future, fn, args = self._queue.get()
+            start = time.perf_counter()
+            with self._lock:
+                self._waiting[lane] -= 1
+                self._running += 1
+                self._waits_ms.append((start - enqueued) * 1000)
+            try:
+                result, error = fn(*args), None
+            except BaseException as e:
+                result, error = None, e
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._running -= 1
+                self.completed += 1
+                self._service_s = elapsed if not self._service_s else 0.8 * self._service_s + 0.2 * elapsed
+            loop.call_soon_threadsafe(self._resolve, future, result, error)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result, error) -> None:
+        if future.cancelled():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def backlog(self) -> int:
+        """Jobs queued or running."""
+        with self._lock:
+            return sum(self._waiting.values()) + self._running
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained, at least 1."""
+        with self._lock:
+            backlog = sum(self._waiting.values()) + self._running
+            return max(1, min(300, math.ceil(backlog * self._service_s / self.workers)))
+
+    def check(self, fast: bool = False) -> None:
+        """Raise QueueFull now if a job in this lane would be rejected, before doing work that would feed it."""
+        lane = self.FAST if fast else self.NORMAL
+        with self._lock:
+            full = self._waiting[lane] >= self.limits[lane]
+            if full:
+                self.rejected += 1
+        if full:
+            raise QueueFull(self.name, self.retry_after())
+
+    async def run(self, fn, *args, fast: bool = False):
+        """Run fn(*args) on a worker thread, or raise QueueFull without queueing it."""
+        lane = self.FAST if fast else self.NORMAL
+        with self._lock:
+            full = self._waiting[lane] >= self.limits[lane]
+            if full:
+                self.rejected += 1
+            else:
+                self._waiting[lane] += 1
+        if full:
+            raise QueueFull(self.name, self.retry_after())
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((lane, next(self._seq), lane, time.perf_counter(), loop, future, fn, args))
+        return await future
+
+    def reset(self) -> None:
+        """Clear the wait samples and the completed/rejected counters."""
+        with self._lock:
+            self._waits_ms.clear()
+            self.completed = 0
+            self.rejected = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits_ms)
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "waiting": self._waiting[self.NORMAL],
+                "waiting_fast": self._waiting[self.FAST],
+                "max_waiting": self.limits[self.NORMAL],
+                "max_waiting_fast": self.limits[self.FAST],
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "service_ms": round(self._service_s * 1000, 3),
+                "wait_ms_p50": round(waits[len(waits) // 2], 3) if waits else 0.0,
+                "wait_ms_p99": round(waits[min(len(waits) - 1, int(0.99 * len(waits)))], 3) if waits else 0.0,
+            }
@@ -0,0 +1,155 @@
+import argparse
+import statistics
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+
+SYSTEM_PROMPT = (
+    "You are Melina, a helpful guide in Elden Ring. Use the provided Data Context to answer the user's "
+    "question accurately. If the context contains stats or lists, format them clearly. If the answer is "
+    "not in the context, say so."
+)
+
+DEFAULT_PROMPTS = [
+    ("Moonveil\nrequiresIntelligence: 23\nrequiresStrength: 12\nrequiresDexterity: 18", "What does Moonveil need to wield?"),
+    ("Godrick the Grafted\nlocatedAt: Stormveil Castle\ndrops: Remembrance of the Grafted", "Where do I find Godrick and what does he drop?"),
+    ("Rennala, Queen of the Full Moon\nlocatedAt: Raya Lucaria Academy", "Who is Rennala?"),
+    ("Sacred Tear\ndescription: Used to strengthen the Flask of Crimson and Cerulean Tears.", "What is a Sacred Tear for?"),
+]
+
+
+class _ForwardCounter:
+    """Counts forward passes of a model (one per decoding or verification step)."""
+
+    def __init__(self, model):
+        self.calls = 0
+        model.register_forward_hook(self._hook)
+
+    def _hook(self, module, args, output):
+        self.calls += 1
+
+
+def _prompt_ids(tokenizer, context: str, question: str, device) -> dict:
+    if tokenizer.chat_template:
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"Data Context:\n{context}\n\nQuestion: {question}"},
+        ]
+        text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    else:
+        text = f"{SYSTEM_PROMPT}\n\nData Context:\n{context}\n\nQuestion: {question}\n"
+    return tokenizer(text, return_tensors="pt").to(device)
+
+
+def _generate(model, inputs: dict, max_new_tokens: int, **kwargs) -> tuple[torch.Tensor, float]:
+    start = time.perf_counter()
+    with torch.no_grad():
+        out = model.generate(**inputs, do_sample=False, max_new_tokens=max_new_tokens, **kwargs)
+    return out[0, inputs["input_ids"].shape[1]:], time.perf_counter() - start
+
+
+def run_benchmark(
+    model_id: str,
+    draft_id: str,
+    draft_tokens: int,
+    max_new_tokens: int,
+    prompts: list[tuple[str, str]],
+    device: str,
+) -> int:
+    """
+    Decode every prompt greedily with and without the draft model and compare.
+    Greedy assisted decoding must reproduce plain decoding token for token, so
+    any mismatch is reported. Acceptance rate is accepted / drafted tokens:
+    each verification pass of the main model emits its accepted draft tokens
+    plus one of its own, and each draft forward pass proposes one token.
+    """
+    print(f"Loading {model_id} and draft {draft_id} on {device}...")
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForCausalLM.from_pretrained(model_id).to(device).eval()
+    draft = AutoModelForCausalLM.from_pretrained(draft_id).to(device=device, dtype=model.dtype).eval()
+    draft.generation_config.num_assistant_tokens = draft_tokens
+    # Draft exactly draft_tokens per step, rather than adapting the count or stopping on low draft confidence.
+    draft.generation_config.num_assistant_tokens_schedule = "constant"
+    draft.generation_config.assistant_confidence_threshold = 0.0
+    if model.config.vocab_size != draft.config.vocab_size:
+        print(f"WARNING: vocab sizes differ ({model.config.vocab_size} vs {draft.config.vocab_size}); "
+              "the draft model must share the main model's tokenizer.")
+
+    target_calls = _ForwardCounter(model)
+    draft_calls = _ForwardCounter(draft)
+
+    # Warm up both paths so one-off allocation does not land in the first timing.
+    inputs = _prompt_ids(tokenizer, *prompts[0], device)
+    _generate(model, inputs, 8)
+    _generate(model, inputs, 8, assistant_model=draft)
+
+    plain_tps, assisted_tps = [], []
+    plain_tokens = assisted_tokens = accepted = drafted = 0
+    mismatches = 0
+    for context, question in prompts:
+        inputs = _prompt_ids(tokenizer, context, question, device)
+        plain, plain_s = _generate(model, inputs, max_new_tokens)
+
+        target_calls.calls = draft_calls.calls = 0
+        assisted, assisted_s = _generate(model, inputs, max_new_tokens, assistant_model=draft)
+        accepted += max(len(assisted) - target_calls.calls, 0)
+        drafted += draft_calls.calls
+
+        plain_tokens += len(plain)
+        assisted_tokens += len(assisted)
+        plain_tps.append(len(plain) / plain_s)
+        assisted_tps.append(len(assisted) / assisted_s)
+        same = torch.equal(plain, assisted)
+        mismatches += not same
+        print(f"  {question[:40]:<40} plain {plain_tps[-1]:7.1f} tok/s  assisted {assisted_tps[-1]:7.1f} tok/s"
+              f"{'' if same else '  OUTPUT DIFFERS'}")
+
+    plain_median = statistics.median(plain_tps)
+    assisted_median = statistics.median(assisted_tps)
+    print(f"\nPrompts:          {len(prompts)} ({plain_tokens} plain / {assisted_tokens} assisted tokens)")
+    print(f"Speculative toks: {draft_tokens}")
+    print(f"Acceptance rate:  {accepted / drafted:.1%} ({accepted}/{drafted} drafted tokens)" if drafted else
+          "Acceptance rate:  n/a (no draft passes)")
+    print(f"Plain:            {plain_median:.1f} tok/s (median)")
+    print(f"Assisted:         {assisted_median:.1f} tok/s (median)")
+    print(f"Speedup:          {assisted_median / plain_median:.2f}x")
+    print(f"Output match:     {len(prompts) - mismatches}/{len(prompts)}")
+    return 1 if mismatches else 0
+
+
+def _load_prompts(path: str) -> list[tuple[str, str]]:
+    """One prompt per line: context and question separated by a tab (\\n in the context is a newline)."""
+    prompts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            context, _, question = line.rstrip("\n").rpartition("\t")
+            prompts.append((context.replace("\\n", "\n"), question))
+    return prompts
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark assisted (draft model) generation against plain decoding.")
+    parser.add_argument("--model", default="Qwen/Qwen2.5-7B-Instruct", help="Main model. Default: Qwen/Qwen2.5-7B-Instruct")
+    parser.add_argument(
+        "--draft",
+        default="Qwen/Qwen2.5-0.5B-Instruct",
+        help="Draft model sharing the main model's tokenizer. Default: Qwen/Qwen2.5-0.5B-Instruct",
+    )
+    parser.add_argument("--draft-tokens", type=int, default=5, help="Speculative tokens per step. Default: 5")
+    parser.add_argument("--max-new-tokens", type=int, default=128, help="Tokens generated per prompt. Default: 128")
+    parser.add_argument("--prompts", default=None, help="Optional prompt file (context<TAB>question per line).")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", help="Default: cuda if available")
+    args = parser.parse_args()
+
+    prompts = _load_prompts(args.prompts) if args.prompts else DEFAULT_PROMPTS
+    if not prompts:
+        parser.error("No prompts.")
+    return run_benchmark(args.model, args.draft, args.draft_tokens, args.max_new_tokens, prompts, args.device)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
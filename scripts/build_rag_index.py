@@ -1,13 +1,25 @@
 import argparse
+import fnmatch
 import json
 import os
+import re
+import shutil
+import textwrap
 import time
 from collections import defaultdict
+from functools import lru_cache
 
+import numpy as np
 import torch
 from rdflib import Graph, Literal, URIRef
 from rdflib.namespace import RDF, RDFS
 from sentence_transformers import SentenceTransformer
+from transformers import AutoTokenizer
+
+from doc_store import DocStore, write_doc_store
+from pca import fit_pca, load_pca, save_pca, search
+from rerank_tokens import PairTemplate, write_rerank_tokens
+from stub_models import STUB_RETRIEVER_ID, StubBiEncoder
 
 
 PREDICATE_LABELS = {
@@ -33,6 +45,23 @@ PREDICATE_LABELS = {
 }
 
 
+ER = "http://example.org/elden_ring/"
+# Linked graph from scripts/linker.py, else the checked-in Turtle version.
+DEFAULT_GRAPHS = ("rdf/elden_ring_fast_linked.nt", "rdf/elden_ring_linked.ttl")
+
+# Cross-encoder the server reranks with (web_server.RERANKER_ID); docs are pre-tokenized for it.
+DEFAULT_RERANKER = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+# Object properties exported as the doc adjacency graph, in predicate-code order.
+NEIGHBOUR_PREDICATES = ("drops", "droppedBy", "locatedAt", "grantsReward", "obtainedFrom", "hasSkill")
+ADJACENCY_FILES = ("adj_indptr.npy", "adj_indices.npy", "adj_predicates.npy")
+# Every file a build may write to the index directory (docs.json: builds before the doc store).
+# Those the current build did not write are removed on publish, so none outlive the doc list.
+INDEX_FILE_PATTERNS = (
+    "meta.json", "embeddings.pt", "embeddings.npy", "docs.json", "docs.bin", "docs_*",
+    "clusters.json", "adj_*.npy", "pca*_*.npy", "rerank_*.npy",
+)
+
+
 def _best_local_name(uri: str) -> str:
     uri = uri.rstrip("/>")
     if "#" in uri:
@@ -152,45 +181,300 @@ def build_entity_documents(g: Graph) -> list[dict]:
     return docs
 
 
-def embed_and_save(
+def chunk_documents(docs: list[dict], max_chars: int) -> list[dict]:
+    """
+    Split entity docs longer than max_chars into chunks of whole predicate
+    lines (over-long lines are wrapped). Every chunk repeats the title and
+    keeps the parent's subject, so hits can be aggregated back to entities.
+    Chunks of one entity are emitted consecutively, in line order.
+    """
+    chunks: list[dict] = []
+    for d in docs:
+        title = d["title"]
+        lines = d["text"].split("\n")[1:]  # text starts with the title line
+        if len(d["text"]) <= max_chars or not lines:
+            chunks.append(d)
+            continue
+
+        budget = max(1, max_chars - len(title) - 1)
+        pieces: list[str] = []
+        for line in lines:
+            pieces.extend(textwrap.wrap(line, width=budget) if len(line) > budget else [line])
+
+        current: list[str] = []
+        size = 0
+        for piece in pieces:
+            if current and size + len(piece) + 1 > budget:
+                chunks.append({"subject": d["subject"], "title": title, "text": title + "\n" + "\n".join(current)})
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 1
+        if current:
+            chunks.append({"subject": d["subject"], "title": title, "text": title + "\n" + "\n".join(current)})
+
+    print(f"Chunked {len(docs):,} entity documents into {len(chunks):,} chunks (max {max_chars} chars)")
+    return chunks
+
+
+def build_adjacency(
+    g: Graph,
     docs: list[dict],
-    out_dir: str,
-    retriever_id: str,
-    graph_info: dict,
-    batch_size: int,
-) -> None:
-    os.makedirs(out_dir, exist_ok=True)
+    clusters: dict[str, list[dict]] | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    CSR adjacency over NEIGHBOUR_PREDICATES edges, keyed by doc index: the
+    neighbours of doc i are indices[indptr[i]:indptr[i + 1]], and predicates
+    holds each edge's code (k = NEIGHBOUR_PREDICATES[k] from doc i to the
+    neighbour, k + len(NEIGHBOUR_PREDICATES) = from the neighbour to doc i).
+    Edges point at an entity's first doc; every chunk of an entity shares its
+    edges, and collapsed near-duplicates resolve to their representative.
+    """
+    first_doc: dict[str, int] = {}
+    for i, d in enumerate(docs):
+        first_doc.setdefault(d["subject"], i)
+    for rep, members in (clusters or {}).items():
+        for m in members:
+            first_doc.setdefault(m["subject"], first_doc[rep])
+
+    pairs = []
+    for code, name in enumerate(NEIGHBOUR_PREDICATES):
+        for s, o in g.subject_objects(URIRef(ER + name)):
+            si, oi = first_doc.get(str(s)), first_doc.get(str(o))
+            if si is not None and oi is not None and si != oi:
+                pairs.append((si, oi, code))
+
+    # Forward edges first, so a pair linked both ways keeps its forward predicate.
+    edges: dict[int, dict[int, int]] = defaultdict(dict)
+    for si, oi, code in pairs:
+        edges[si].setdefault(oi, code)
+    for si, oi, code in pairs:
+        edges[oi].setdefault(si, code + len(NEIGHBOUR_PREDICATES))
+
+    indptr = np.zeros(len(docs) + 1, dtype=np.int64)
+    indices: list[int] = []
+    predicates: list[int] = []
+    for i, d in enumerate(docs):
+        row = edges.get(first_doc[d["subject"]], {})
+        indices.extend(row)
+        predicates.extend(row.values())
+        indptr[i + 1] = len(indices)
+
+    print(f"Built adjacency: {len(pairs):,} edges, {int(indptr[-1]):,} doc links")
+    return indptr, np.array(indices, dtype=np.int32), np.array(predicates, dtype=np.int8)
+
+
+def _load_previous_embeddings(out_dir: str, retriever_id: str) -> dict[str, torch.Tensor]:
+    """Map doc text -> embedding from an existing index built with the same retriever."""
+    docs_path = os.path.join(out_dir, "docs.json")  # indexes from before the doc store
+    emb_path = os.path.join(out_dir, "embeddings.pt")
+    meta_path = os.path.join(out_dir, "meta.json")
+    has_store = DocStore.exists(out_dir)
+    if not (os.path.exists(emb_path) and os.path.exists(meta_path) and (has_store or os.path.exists(docs_path))):
+        return {}
+
+    with open(meta_path, "r", encoding="utf-8") as f:
+        if json.load(f).get("retriever_id") != retriever_id:
+            return {}
+    if has_store:
+        prev_texts = DocStore(out_dir).column("text")
+    else:
+        with open(docs_path, "r", encoding="utf-8") as f:
+            prev_texts = [d["text"] for d in json.load(f)]
+    prev_emb = torch.load(emb_path, map_location="cpu")
+    return {prev_texts[i]: prev_emb[i] for i in range(len(prev_texts))}
+
 
+@lru_cache(maxsize=None)
+def _retriever(retriever_id: str) -> SentenceTransformer:
+    if retriever_id == STUB_RETRIEVER_ID:
+        # Deterministic hashed bag-of-words vectors; no weights needed (see stub_models.py).
+        return StubBiEncoder()
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"Loading retriever {retriever_id} on {device}...")
-    bi = SentenceTransformer(retriever_id, device=device)
+    return SentenceTransformer(retriever_id, device=device)
+
+
+def embed_texts(
+    texts: list[str],
+    retriever_id: str,
+    batch_size: int,
+    cache: dict[str, torch.Tensor],
+) -> torch.Tensor:
+    """Embed texts, encoding only those missing from cache (text -> embedding), which is updated in place."""
+    missing = [t for t in dict.fromkeys(texts) if t not in cache]
 
-    texts = [d["text"] for d in docs]
     start = time.time()
-    embeddings = bi.encode(
-        texts,
-        convert_to_tensor=True,
-        show_progress_bar=True,
-        batch_size=batch_size,
-        normalize_embeddings=True,
+    if missing:
+        new_embeddings = _retriever(retriever_id).encode(
+            missing,
+            convert_to_tensor=True,
+            show_progress_bar=True,
+            batch_size=batch_size,
+            normalize_embeddings=True,
+        )
+        cache.update(zip(missing, new_embeddings.detach().cpu()))
+    embeddings = torch.stack([cache[t] for t in texts])
+    print(
+        f"Embedded {len(missing):,} docs (reused {len(texts) - len(missing):,}) "
+        f"in {time.time() - start:.2f}s"
     )
-    print(f"Embedded {len(texts):,} docs in {time.time() - start:.2f}s")
+    return embeddings
 
-    docs_path = os.path.join(out_dir, "docs.json")
-    emb_path = os.path.join(out_dir, "embeddings.pt")
-    meta_path = os.path.join(out_dir, "meta.json")
 
-    with open(docs_path, "w", encoding="utf-8") as f:
-        json.dump(docs, f, ensure_ascii=False)
+def _title_key(title: str) -> str:
+    """Normalize away variant markers: "+2 Variant", "(Altered)", "[3]", digits and punctuation."""
+    key = title.lower()
+    key = re.sub(r"\(altered\)|\bvariant\b|\[\s*\d+\s*\]|\+\s*\d+", " ", key)
+    key = re.sub(r"[^a-z]+", " ", key)
+    return " ".join(key.split())
+
+
+def collapse_near_duplicates(
+    docs: list[dict],
+    embeddings: torch.Tensor,
+    threshold: float,
+) -> tuple[list[dict], torch.Tensor, dict[str, list[dict]]]:
+    """
+    Cluster docs that share a normalized title and whose embeddings have
+    cosine similarity >= threshold with the cluster representative (the
+    shortest title). Returns the representatives, their embeddings and a
+    representative subject -> member [{subject, title}] table.
+    """
+    groups: dict[str, list[int]] = defaultdict(list)
+    for i, d in enumerate(docs):
+        groups[_title_key(d["title"])].append(i)
+
+    keep: list[int] = []
+    clusters: dict[str, list[dict]] = {}
+    for idxs in groups.values():
+        idxs.sort(key=lambda i: (len(docs[i]["title"]), i))
+        reps: list[int] = []
+        for i in idxs:
+            if reps:
+                sims = embeddings[reps] @ embeddings[i]
+                best = int(torch.argmax(sims))
+                if float(sims[best]) >= threshold:
+                    rep = docs[reps[best]]["subject"]
+                    clusters.setdefault(rep, []).append({"subject": docs[i]["subject"], "title": docs[i]["title"]})
+                    continue
+            reps.append(i)
+        keep.extend(reps)
+
+    keep.sort()
+    print(f"Collapsed {len(docs):,} docs into {len(keep):,} representatives ({len(clusters):,} clusters with variants)")
+    return [docs[i] for i in keep], embeddings[keep], clusters
+
+
+def evaluate_pca(
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    dims_list: list[int],
+    top_k: int,
+    pool_factor: int,
+    out_dir: str,
+) -> list[dict]:
+    """
+    Recall@top_k of reduced-dimension search (pool_factor * top_k candidates,
+    rescored at full precision) against the exact full-width top_k, and
+    per-query latency of both, one query at a time as the server runs them.
+    """
+
+    def timed(reduced):
+        ids = []
+        start = time.perf_counter()
+        for q in queries:
+            ids.append(search(q[None, :], embeddings, top_k, reduced, pool_factor * top_k)[0][0])
+        return ids, (time.perf_counter() - start) * 1000 / len(queries)
+
+    exact, full_ms = timed(None)
+    rows = [{"dims": int(embeddings.shape[1]), "recall": 1.0, "ms_per_query": full_ms}]
+    for dims in dims_list:
+        found, ms = timed(load_pca(out_dir, dims))
+        recall = float(np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(exact, found)]))
+        rows.append({"dims": dims, "recall": recall, "ms_per_query": ms})
+
+    print(f"\nFirst-stage search over {len(embeddings):,} docs, {len(queries)} title queries, top {top_k} "
+          f"(pool {pool_factor * top_k}):")
+    print(f"{'Dims':>6} {'Recall@' + str(top_k):>10} {'ms/query':>10}")
+    for row in rows:
+        print(f"{row['dims']:>6} {row['recall']:>10.3f} {row['ms_per_query']:>10.3f}")
+    return rows
+
+
+def save_index(
+    docs: list[dict],
+    embeddings: torch.Tensor,
+    out_dir: str,
+    retriever_id: str,
+    graph_info: dict,
+    chunk_chars: int = 0,
+    clusters: dict[str, list[dict]] | None = None,
+    adjacency: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None,
+    pca_dims: list[int] | None = None,
+    compress_docs: bool = False,
+    reranker_id: str | None = None,
+    rerank_max_length: int = 512,
+) -> None:
+    os.makedirs(out_dir, exist_ok=True)
+    # Files are written to a staging directory, then moved into out_dir (see the end).
+    staging = out_dir.rstrip("/\\") + ".staging"
+    shutil.rmtree(staging, ignore_errors=True)  # left behind by a build that crashed
+    os.makedirs(staging)
+
+    emb_path = os.path.join(staging, "embeddings.pt")
+    emb_npy_path = os.path.join(staging, "embeddings.npy")
+    meta_path = os.path.join(staging, "meta.json")
 
     # Save on CPU for portability; server can move to GPU at runtime.
     torch.save(embeddings.detach().cpu(), emb_path)
 
+    # Memory-mappable copies, shared read-only by server workers through the page cache.
+    # The doc store replaces docs.json (see scripts/doc_store.py).
+    np.save(emb_npy_path, embeddings.detach().cpu().numpy().astype(np.float32))
+    write_doc_store(docs, staging, compress=compress_docs)
+
+    # Doc token ids for the reranker (see scripts/rerank_tokens.py), so requests only tokenize the query.
+    rerank_info = None
+    if reranker_id:
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(reranker_id)
+        except OSError as e:
+            print(f"Could not load the {reranker_id} tokenizer ({e}); skipping pre-tokenized docs.")
+        else:
+            doc_tokens = rerank_max_length - PairTemplate(tokenizer).special - 1  # at least one query token
+            write_rerank_tokens([d["text"] for d in docs], tokenizer, doc_tokens, staging)
+            rerank_info = {"reranker_id": reranker_id, "max_length": rerank_max_length, "doc_tokens": doc_tokens}
+
+    # Representative subject -> near-duplicate members that were not indexed.
+    clusters_path = os.path.join(staging, "clusters.json")
+    with open(clusters_path, "w", encoding="utf-8") as f:
+        json.dump(clusters or {}, f, ensure_ascii=False)
+
+    # Reduced-dimension copies for first-stage search (see scripts/pca.py).
+    for dims in pca_dims or []:
+        emb_np = embeddings.detach().cpu().numpy().astype(np.float32)
+        save_pca(staging, emb_np, *fit_pca(emb_np, dims))
+
+    # CSR neighbour graph (see build_adjacency), memory-mapped by the server.
+    if adjacency is not None:
+        for name, array in zip(ADJACENCY_FILES, adjacency):
+            np.save(os.path.join(staging, name), array)
+
     meta = {
         "created_at": int(time.time()),
         "retriever_id": retriever_id,
         "embedding_dim": int(embeddings.shape[1]),
         "doc_count": int(len(docs)),
+        # >0: docs are chunks of at most this many chars; "subject" is the parent entity.
+        "chunk_chars": int(chunk_chars),
+        "entity_count": int(len({d["subject"] for d in docs})),
+        "cluster_count": int(len(clusters or {})),
+        "adjacency": (
+            {"predicates": list(NEIGHBOUR_PREDICATES), "edge_count": int(len(adjacency[1]))} if adjacency is not None else None
+        ),
+        "pca_dims": sorted(pca_dims or []),
+        "doc_compression": "zlib" if compress_docs else "none",
+        "rerank_tokens": rerank_info,
         "graph": graph_info,
         "cuda_available": bool(torch.cuda.is_available()),
         "torch_version": torch.__version__,
@@ -198,27 +482,48 @@ def embed_and_save(
     with open(meta_path, "w", encoding="utf-8") as f:
         json.dump(meta, f, ensure_ascii=False, indent=2)
 
-    print(f"Wrote {docs_path}")
-    print(f"Wrote {emb_path}")
-    print(f"Wrote {meta_path}")
+    # Publish file by file, drop the files of earlier builds this one did not write, then meta.json.
+    # os.replace gives every file a new inode, so a running server keeps reading the old ones it
+    # has mapped until it reloads on the new meta.json.
+    written = set(os.listdir(staging))
+    for name in sorted(written - {"meta.json"}):
+        os.replace(os.path.join(staging, name), os.path.join(out_dir, name))
+    for name in os.listdir(out_dir):
+        if name not in written and any(fnmatch.fnmatch(name, p) for p in INDEX_FILE_PATTERNS):
+            os.remove(os.path.join(out_dir, name))
+    os.replace(meta_path, os.path.join(out_dir, "meta.json"))
+    os.rmdir(staging)
+
+    print(f"Wrote {os.path.join(out_dir, 'embeddings.pt')}")
+    print(f"Wrote {os.path.join(out_dir, 'embeddings.npy')}")
+    store_bytes = os.path.getsize(os.path.join(out_dir, "docs.bin"))
+    print(f"Wrote doc store to {out_dir} ({store_bytes / 1e6:.1f} MB{', zlib' if compress_docs else ''})")
+    print(f"Wrote {os.path.join(out_dir, 'clusters.json')}")
+    for dims in pca_dims or []:
+        print(f"Wrote {dims}-dim PCA projection (pca{dims}_*.npy)")
+    if adjacency is not None:
+        print(f"Wrote adjacency ({', '.join(ADJACENCY_FILES)})")
+    if rerank_info is not None:
+        print(f"Wrote {reranker_id} doc tokens (at most {rerank_info['doc_tokens']} per doc)")
+    print(f"Wrote {os.path.join(out_dir, 'meta.json')}")
 
 
 def main() -> int:
     parser = argparse.ArgumentParser(description="Build a persisted RAG index from Elden Ring RDF.")
     parser.add_argument(
         "--graph",
-        default="rdf/elden_ring_fast_linked.nt",
-        help="Path to RDF graph (.ttl or .nt). Default: rdf/elden_ring_fast_linked.nt",
+        default=None,
+        help=f"Path to RDF graph (.ttl or .nt). Default: {DEFAULT_GRAPHS[0]}, else the checked-in {DEFAULT_GRAPHS[1]}",
     )
     parser.add_argument(
         "--out",
         default="rag_index",
-        help="Output directory for docs/embeddings/meta. Default: rag_index",
+        help="Output directory for the doc store, embeddings and meta. Default: rag_index",
     )
     parser.add_argument(
         "--retriever",
         default="all-MiniLM-L6-v2",
-        help="SentenceTransformer model id. Default: all-MiniLM-L6-v2",
+        help=f"SentenceTransformer model id, or '{STUB_RETRIEVER_ID}' for weight-free stub vectors. Default: all-MiniLM-L6-v2",
     )
     parser.add_argument(
         "--batch-size",
@@ -226,9 +531,55 @@ def main() -> int:
         default=64,
         help="Embedding batch size. Default: 64",
     )
+    parser.add_argument(
+        "--chunk-chars",
+        type=int,
+        default=0,
+        help="Split entity docs longer than this into chunks (keeps cross-encoder inputs short). Default: 0 (off)",
+    )
+    parser.add_argument(
+        "--dedup-threshold",
+        type=float,
+        default=0.0,
+        help="Collapse docs with the same normalized title and cosine similarity >= this (e.g. 0.95). Default: 0 (off)",
+    )
+    parser.add_argument(
+        "--pca-dims",
+        type=int,
+        nargs="+",
+        default=[],
+        help="Also store PCA-reduced embeddings at these widths (e.g. 128 256) and report their recall. Default: none",
+    )
+    parser.add_argument(
+        "--pca-pool",
+        type=int,
+        default=4,
+        help="Candidate pool multiplier used when reporting reduced-dimension recall. Default: 4",
+    )
+    parser.add_argument(
+        "--compress-docs",
+        action="store_true",
+        help="zlib-compress doc texts in the doc store (about 3-4x smaller, ~20us to decode each text read).",
+    )
+    parser.add_argument(
+        "--reranker",
+        default=DEFAULT_RERANKER,
+        help=f"Cross-encoder whose tokenizer pre-tokenizes the docs for reranking, or 'none'. Default: {DEFAULT_RERANKER}",
+    )
+    parser.add_argument(
+        "--rerank-max-length",
+        type=int,
+        default=512,
+        help="Reranker input length in tokens (query + doc + special tokens). Default: 512",
+    )
+    parser.add_argument(
+        "--reuse",
+        action="store_true",
+        help="Reuse embeddings from an existing index in --out for docs whose text is unchanged.",
+    )
     args = parser.parse_args()
 
-    graph_path = args.graph
+    graph_path = args.graph or next((p for p in DEFAULT_GRAPHS if os.path.exists(p)), DEFAULT_GRAPHS[0])
     if not os.path.exists(graph_path):
         raise FileNotFoundError(
             f"Graph not found: {graph_path}. Make sure you generated rdf/elden_ring_linked.ttl and scripts/optimize.py output first."
@@ -236,13 +587,46 @@ def main() -> int:
 
     g = _load_graph(graph_path)
     docs = build_entity_documents(g)
-    embed_and_save(
+    cache = _load_previous_embeddings(args.out, args.retriever) if args.reuse else {}
+
+    clusters: dict[str, list[dict]] = {}
+    if args.dedup_threshold > 0:
+        embeddings = embed_texts([d["text"] for d in docs], args.retriever, args.batch_size, cache)
+        docs, embeddings, clusters = collapse_near_duplicates(docs, embeddings, args.dedup_threshold)
+    if args.chunk_chars > 0:
+        docs = chunk_documents(docs, args.chunk_chars)
+    if args.chunk_chars > 0 or args.dedup_threshold <= 0:
+        embeddings = embed_texts([d["text"] for d in docs], args.retriever, args.batch_size, cache)
+
+    save_index(
         docs=docs,
+        embeddings=embeddings,
         out_dir=args.out,
         retriever_id=args.retriever,
         graph_info=_graph_stats(graph_path),
-        batch_size=args.batch_size,
+        chunk_chars=args.chunk_chars,
+        clusters=clusters,
+        adjacency=build_adjacency(g, docs, clusters),
+        pca_dims=[d for d in args.pca_dims if d < embeddings.shape[1]],
+        compress_docs=args.compress_docs,
+        reranker_id=None if args.reranker == "none" else args.reranker,
+        rerank_max_length=args.rerank_max_length,
     )
+
+    if args.pca_dims:
+        # Entity titles stand in for user queries.
+        sample = np.random.default_rng(0).choice(len(docs), size=min(200, len(docs)), replace=False)
+        queries = _retriever(args.retriever).encode(
+            [docs[i]["title"] for i in sample], convert_to_tensor=True, normalize_embeddings=True
+        )
+        evaluate_pca(
+            embeddings.detach().cpu().numpy().astype(np.float32),
+            queries.detach().cpu().numpy().astype(np.float32),
+            [d for d in args.pca_dims if d < embeddings.shape[1]],
+            top_k=10,
+            pool_factor=args.pca_pool,
+            out_dir=args.out,
+        )
     return 0
 
 
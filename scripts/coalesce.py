@@ -0,0 +1,99 @@
+import asyncio
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query, for coalescing and logging."""
+    return " ".join(query.lower().split())
+
+
+class Broadcast:
+    """
+    Append-only event log filled by one producer. Every subscriber replays
+    the events published so far and then follows new ones until close().
+    Use from the event loop thread only.
+    """
+
+    def __init__(self):
+        self.events: list = []
+        self.done = False
+        self.error: BaseException | None = None
+        self._changed = asyncio.Event()
+
+    def _wake(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, event) -> None:
+        self.events.append(event)
+        self._wake()
+
+    def close(self, error: BaseException | None = None) -> None:
+        self.done = True
+        self.error = error
+        self._wake()
+
+    async def subscribe(self):
+        i = 0
+        while True:
+            while i < len(self.events):
+                yield self.events[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical work: the first caller for a key starts
+    it as a task, callers arriving while it runs share that task's result
+    (or its Broadcast, for streams). The work is not cancelled when a caller
+    goes away; the key is released as soon as the work finishes.
+    """
+
+    def __init__(self):
+        self._inflight: dict = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def _join(self, key, start):
+        entry = self._inflight.get(key)
+        if entry is not None:
+            self.followers += 1
+            return entry
+        entry = start()
+        self._inflight[key] = entry
+        self.leaders += 1
+        entry[0].add_done_callback(lambda _: self._inflight.pop(key, None))
+        return entry
+
+    async def run(self, key, fn):
+        """Await fn() at most once per key at a time; concurrent callers get the same result or exception."""
+        task, _ = self._join(key, lambda: (asyncio.ensure_future(fn()), None))
+        return await asyncio.shield(task)
+
+    def stream(self, key, fn) -> Broadcast:
+        """Start fn(broadcast) at most once per key at a time; concurrent callers subscribe to the same Broadcast."""
+
+        def start():
+            broadcast = Broadcast()
+            return asyncio.ensure_future(self._produce(fn, broadcast)), broadcast
+
+        return self._join(key, start)[1]
+
+    @staticmethod
+    async def _produce(fn, broadcast: Broadcast) -> None:
+        try:
+            await fn(broadcast)
+        except asyncio.CancelledError as e:
+            broadcast.close(e)
+            raise
+        except Exception as e:
+            broadcast.close(e)
+        else:
+            broadcast.close()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._inflight), "leaders": self.leaders, "followers": self.followers}
@@ -1,64 +1,245 @@
+import argparse
+import os
+import statistics
+import sys
 import time
-from rdflib import Graph, Namespace
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
-print("Loading Fast Graph...")
-start = time.time()
-g = Graph()
-# LOAD THE FAST FILE
-g.parse("rdf/elden_ring_fast_linked.nt", format="nt") 
-print(f"Loaded {len(g)} triples in {time.time() - start:.4f} seconds.")
+from rdflib import Graph
 
-# Queries (Same as before)
+from sqlite_store import SQLiteStore
+from triple_store import TripleStore, nt_value
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ER = "http://example.org/elden_ring/"
+TYPE = "<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>"
+LABEL = "<http://www.w3.org/2000/01/rdf-schema#label>"
+
+# Graph backends the benchmark knows how to load: name -> (path, loader kind)
+BACKENDS = {
+    "rdflib-ttl": ("rdf/elden_ring_linked.ttl", "turtle"),
+    "rdflib-nt": ("rdf/elden_ring_fast_linked.nt", "nt"),
+    "store": ("rdf/elden_ring_store", "store"),
+    "sqlite": ("rdf/elden_ring.sqlite", "sqlite"),
+}
+
+PREFIXES = f"""
+    PREFIX er: <{ER}>
+    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+"""
+
+
+def _int_weapons(store: TripleStore | SQLiteStore) -> list[tuple]:
+    rows = store.query([
+        ("?w", f"<{ER}requiresIntelligence>", "?int"),
+        ("?w", f"<{ER}requiresStrength>", "?str"),
+        ("?w", LABEL, "?weaponName"),
+    ])
+    rows = [(nt_value(r["?weaponName"]), int(nt_value(r["?int"])), int(nt_value(r["?str"]))) for r in rows]
+    rows = sorted({r for r in rows if r[2] < 12}, key=lambda r: r[1])
+    return [(name, i) for name, i, _ in rows][:10]
+
+
+def _remembrances(store: TripleStore | SQLiteStore) -> list[tuple]:
+    rows = store.query([
+        ("?rem", TYPE, f"<{ER}Remembrance>"),
+        ("?rem", LABEL, "?remName"),
+        ("?rem", f"<{ER}droppedBy>", "?boss"),
+        ("?boss", LABEL, "?bossName"),
+    ])
+    return sorted((nt_value(r["?bossName"]), nt_value(r["?remName"])) for r in rows)[:10]
+
+
+def _location_counts(store: TripleStore | SQLiteStore) -> list[tuple]:
+    rows = store.query([
+        ("?boss", TYPE, f"<{ER}Boss>"),
+        ("?boss", f"<{ER}locatedAt>", "?loc"),
+        ("?loc", LABEL, "?locName"),
+    ])
+    counts = Counter(nt_value(r["?locName"]) for r in rows)
+    return counts.most_common(5)
+
+
+def _remembrance_rewards(store: TripleStore | SQLiteStore) -> list[tuple]:
+    rows = store.query([
+        ("?rem", TYPE, f"<{ER}Remembrance>"),
+        ("?rem", LABEL, "?remName"),
+        ("?rem", f"<{ER}grantsReward>", "?item"),
+        ("?item", LABEL, "?itemName"),
+    ], limit=5)
+    return [(nt_value(r["?remName"]), nt_value(r["?itemName"])) for r in rows]
+
+
+def _boss_drops(store: TripleStore | SQLiteStore) -> list[tuple]:
+    rows = store.query([
+        ("?boss", TYPE, f"<{ER}Boss>"),
+        ("?boss", LABEL, "?bossName"),
+        ("?boss", f"<{ER}drops>", "?item"),
+        ("?item", LABEL, "?itemName"),
+    ], limit=5)
+    return [(nt_value(r["?bossName"]), nt_value(r["?itemName"])) for r in rows]
+
+
+# Each competency question as SPARQL (rdflib backends) and as a basic graph
+# pattern plus post-processing (store and sqlite backends).
 queries = {
-    "1. INT Weapons": """
-        PREFIX er: <http://www.semanticweb.org/fall2025/eldenring/>
-        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-        PREFIX attribute: <http://www.semanticweb.org/fall2025/eldenring/Attribute/>
-        SELECT DISTINCT ?weaponName ?weight WHERE {
-            ?w a er:Weapon ; rdfs:label ?weaponName ; er:hasWeight ?weight .
-            ?u er:isUpgradeOf ?w ; er:scalesWith attribute:Int .
-            FILTER(STRENDS(STR(?u), "Standard")) FILTER (?weight < 3.0)
-        } ORDER BY ?weight LIMIT 10
-    """,
-    "2. Remembrances": """
-        PREFIX er: <http://www.semanticweb.org/fall2025/eldenring/>
-        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+    "1. INT Weapons": (PREFIXES + """
+        SELECT DISTINCT ?weaponName ?int WHERE {
+            ?w er:requiresIntelligence ?int ; er:requiresStrength ?str ; rdfs:label ?weaponName .
+            FILTER (?str < 12)
+        } ORDER BY ?int LIMIT 10
+    """, _int_weapons),
+    "2. Remembrances": (PREFIXES + """
         SELECT ?bossName ?remName WHERE {
             ?rem a er:Remembrance ; rdfs:label ?remName ; er:droppedBy ?boss .
             ?boss rdfs:label ?bossName .
         } ORDER BY ?bossName LIMIT 10
-    """,
-    "3. Location Counts": """
-        PREFIX er: <http://www.semanticweb.org/fall2025/eldenring/>
-        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+    """, _remembrances),
+    "3. Location Counts": (PREFIXES + """
         SELECT ?locName (COUNT(?boss) as ?bossCount) WHERE {
-            ?loc a er:Location ; rdfs:label ?locName ; er:hasBoss ?boss .
+            ?boss a er:Boss ; er:locatedAt ?loc .
+            ?loc rdfs:label ?locName .
         } GROUP BY ?locName ORDER BY DESC(?bossCount) LIMIT 5
-    """,
-    "4. Cookbooks": """
-        PREFIX er: <http://www.semanticweb.org/fall2025/eldenring/>
-        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-        SELECT ?bookName ?itemName WHERE {
-            ?book a er:Cookbook ; rdfs:label ?bookName ; er:unlocksRecipeFor ?item .
+    """, _location_counts),
+    "4. Remembrance Rewards": (PREFIXES + """
+        SELECT ?remName ?itemName WHERE {
+            ?rem a er:Remembrance ; rdfs:label ?remName ; er:grantsReward ?item .
             ?item rdfs:label ?itemName .
         } LIMIT 5
-    """,
-    "5. Whetblades": """
-        PREFIX er: <http://www.semanticweb.org/fall2025/eldenring/>
-        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-        SELECT ?bladeName ?affinityName WHERE {
-            ?w a er:Whetblade ; rdfs:label ?bladeName ; er:unlocksAffinity ?a .
-            ?a rdfs:label ?affinityName .
+    """, _remembrance_rewards),
+    "5. Boss Drops": (PREFIXES + """
+        SELECT ?bossName ?itemName WHERE {
+            ?boss a er:Boss ; rdfs:label ?bossName ; er:drops ?item .
+            ?item rdfs:label ?itemName .
         } LIMIT 5
-    """
+    """, _boss_drops),
 }
 
-for title, q in queries.items():
-    print(f"\n{title}")
-    try:
-        results = g.query(q)
-        if len(results) == 0: print("No results.")
-        else:
-            for row in results:
-                print(f"{', '.join([str(i).split('/')[-1] for i in row])}")
-    except Exception as e: print(f"Error: {e}")
\ No newline at end of file
+
+def _load_backend(name: str):
+    path, kind = BACKENDS[name]
+    if kind == "store":
+        return TripleStore(path)
+    if kind == "sqlite":
+        return SQLiteStore(path)
+    g = Graph()
+    g.parse(path, format=kind)
+    return g
+
+
+def _run_query(backend, title: str) -> list[tuple]:
+    sparql, store_fn = queries[title]
+    if not isinstance(backend, Graph):
+        return store_fn(backend)
+    return [tuple(row) for row in backend.query(sparql)]
+
+
+def _peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def bench_backend(name: str, warmup: int, repeat: int) -> dict:
+    """Load one backend and time every competency query. Runs in its own process so peak RSS is per backend."""
+    start = time.perf_counter()
+    backend = _load_backend(name)
+    load_s = time.perf_counter() - start
+
+    results = {}
+    for title in queries:
+        for _ in range(warmup):
+            _run_query(backend, title)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = _run_query(backend, title)
+            timings.append(time.perf_counter() - start)
+        results[title] = {"rows": len(rows), "timings": timings}
+
+    return {"load_s": load_s, "queries": results, "peak_rss_mb": _peak_rss_mb()}
+
+
+def run_benchmark(backends: list[str], warmup: int, repeat: int) -> int:
+    reports = {}
+    for name in backends:
+        path, _ = BACKENDS[name]
+        if not os.path.exists(path):
+            print(f"Skipping {name}: {path} not found")
+            continue
+        print(f"Benchmarking {name} ({path})...")
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            reports[name] = pool.submit(bench_backend, name, warmup, repeat).result()
+
+    if not reports:
+        print("No backends available.")
+        return 1
+
+    print(f"\n{'Backend':<12} {'Load':>9} {'Peak RSS':>10}")
+    for name, report in reports.items():
+        rss = f"{report['peak_rss_mb']:.0f} MB" if report["peak_rss_mb"] is not None else "n/a"
+        print(f"{name:<12} {report['load_s']:>8.2f}s {rss:>10}")
+
+    mismatched = False
+    print(f"\n{'Query':<24} {'Backend':<12} {'Rows':>5} {'Median':>10} {'Min':>10}")
+    for title in queries:
+        counts = set()
+        for name, report in reports.items():
+            q = report["queries"][title]
+            counts.add(q["rows"])
+            median_ms = statistics.median(q["timings"]) * 1000
+            min_ms = min(q["timings"]) * 1000
+            print(f"{title:<24} {name:<12} {q['rows']:>5} {median_ms:>8.2f}ms {min_ms:>8.2f}ms")
+        if len(counts) > 1:
+            print(f"   WARNING: result counts differ across backends: {sorted(counts)}")
+            mismatched = True
+        elif counts == {0}:
+            print("   WARNING: query returned no rows")
+            mismatched = True
+
+    return 1 if mismatched else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run the competency questions, optionally as a backend benchmark.")
+    parser.add_argument("--bench", action="store_true", help="Benchmark every available backend instead of printing rows.")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=list(BACKENDS),
+        default=list(BACKENDS),
+        help="Backends to benchmark. Default: all available",
+    )
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs per query. Default: 1")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per query. Default: 5")
+    args = parser.parse_args()
+
+    if args.bench:
+        return run_benchmark(args.backends, args.warmup, args.repeat)
+
+    print("Loading Fast Graph...")
+    start = time.time()
+    g = _load_backend("rdflib-nt")
+    print(f"Loaded {len(g)} triples in {time.time() - start:.4f} seconds.")
+
+    for title in queries:
+        print(f"\n{title}")
+        try:
+            results = _run_query(g, title)
+            if len(results) == 0: print("No results.")
+            else:
+                for row in results:
+                    print(f"{', '.join([str(i).split('/')[-1] for i in row])}")
+        except Exception as e: print(f"Error: {e}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
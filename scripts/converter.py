@@ -1,8 +1,13 @@
+import argparse
 import csv
+import heapq
 import json
 import os
 import ast
 import re
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from rdflib import Graph, Literal, RDF, RDFS, Namespace, URIRef, XSD
 
 # Namespaces
@@ -55,15 +60,89 @@ def get_files(data_dir):
                 csv_files.append(os.path.join(root, file))
     return csv_files
 
+def nt_term(term):
+    """
+    Serializes a URIRef or Literal in N-Triples syntax.
+    """
+    if isinstance(term, Literal):
+        lexical = str(term).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+        if term.language:
+            return f'"{lexical}"@{term.language}'
+        if term.datatype:
+            return f'"{lexical}"^^<{term.datatype}>'
+        return f'"{lexical}"'
+    return f"<{term}>"
+
+class NTriplesWriter:
+    """
+    Buffers triples as N-Triples lines and spills them to sorted,
+    deduplicated run files in run_dir once chunk_size lines are buffered,
+    so memory stays bounded regardless of the data size.
+    """
+    def __init__(self, run_dir, chunk_size=200_000):
+        self.run_dir = run_dir
+        self.chunk_size = chunk_size
+        self.lines = []
+        self.runs = []
+
+    def add(self, triple):
+        s, p, o = triple
+        self.lines.append(f"{nt_term(s)} {nt_term(p)} {nt_term(o)} .\n")
+        if len(self.lines) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.lines:
+            return
+        fd, path = tempfile.mkstemp(suffix=".nt", dir=self.run_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.writelines(sorted(set(self.lines)))
+        self.runs.append(path)
+        self.lines = []
+
+def merge_runs(run_paths, output_path):
+    """
+    Merges sorted run files into one sorted, deduplicated N-Triples file.
+    Returns the number of triples written.
+    """
+    files = [open(path, 'r', encoding='utf-8') for path in run_paths]
+    count = 0
+    try:
+        with open(output_path, 'w', encoding='utf-8') as out:
+            last = None
+            for line in heapq.merge(*files):
+                if line != last:
+                    out.write(line)
+                    last = line
+                    count += 1
+    finally:
+        for f in files:
+            f.close()
+    return count
+
+def _convert_file(data_dir, file_path, run_dir):
+    """
+    Pool worker: converts a single CSV into its own sorted N-Triples run and
+    returns the run paths, registered names and pending links so the parent
+    can merge them and resolve links once every file has been seen.
+    """
+    converter = EldenRingConverter(data_dir, run_dir)
+    converter.convert_file(file_path)
+    converter.triples.flush()
+    return converter.triples.runs, converter.registry, converter.pending_links
+
 class EldenRingConverter:
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, run_dir=None):
         self.data_dir = data_dir
-        self.graph = Graph()
-        self.graph.bind("er", ER)
-        self.graph.bind("schema", SCHEMA)
+        self.triples = NTriplesWriter(run_dir)
         
         # Registry: name -> URI
         self.registry = {}
+
+        # Cross-entity references queued during conversion and resolved
+        # against the full registry afterwards: (subject URI, kind, target name)
+        self.pending_links = []
+        self.unresolved = defaultdict(list)
         
         # Category mapping for Weapons
         self.weapon_category_map = {
@@ -112,49 +191,109 @@ class EldenRingConverter:
             "Beast Claws": ER.BeastClaw
         }
 
-    def build_registry(self):
+    def convert_file(self, file_path):
         """
-        Pass 1: Scan all files and build a registry of Name -> URI.
-        This allows us to link entities even if they appear in different files.
+        Generate RDF triples for a single CSV file into self.triples.
+        Names are registered as rows are read; references to other entities
+        are queued in self.pending_links for resolve_links.
         """
-        print("Building Registry...")
-        files = get_files(self.data_dir)
-        
-        for file_path in files:
-            filename = os.path.basename(file_path)
-            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if 'name' in row and row['name']:
-                        name = row['name'].strip()
-                        uri = ER[clean_name(name)]
-                        self.registry[name] = uri
-                        
-                        # Also register by ID if available (optional, but good for debugging)
-                        # if 'id' in row:
-                        #     self.registry[f"{filename}:{row['id']}"] = uri
-
-    def convert(self):
+        filename = os.path.basename(file_path)
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                self.process_row(filename, row)
+
+    def convert(self, workers=None, fmt="nt"):
         """
-        Pass 2: Generate RDF triples.
+        Single pass over the CSVs: literal triples are emitted right away and
+        cross-entity references are queued, then resolved in memory.
+        Each CSV is converted in a process pool to its own sorted N-Triples
+        run (workers=None uses every core, workers=1 stays in-process). Runs
+        are merge-sorted and deduplicated straight into the output file, so
+        output is deterministic. fmt="turtle" additionally loads the merged
+        triples into a Graph to write Turtle (not memory-bounded).
         """
         print("Converting Data...")
-        files = get_files(self.data_dir)
-        
-        for file_path in files:
-            filename = os.path.basename(file_path)
-            print(f"Processing {filename}...")
-            
-            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    self.process_row(filename, row)
-        
-        # Serialize
-        output_path = os.path.join(os.path.dirname(self.data_dir), "rdf", "elden_ring_full.ttl")
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        self.graph.serialize(destination=output_path, format="turtle")
-        print(f"Conversion complete. Saved to {output_path}")
+        files = sorted(get_files(self.data_dir))
+        rdf_dir = os.path.join(os.path.dirname(self.data_dir), "rdf")
+        os.makedirs(rdf_dir, exist_ok=True)
+
+        with tempfile.TemporaryDirectory(dir=rdf_dir) as run_dir:
+            self.triples = NTriplesWriter(run_dir)
+            runs = []
+            if workers == 1:
+                for file_path in files:
+                    print(f"Processing {os.path.basename(file_path)}...")
+                    self.convert_file(file_path)
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    futures = [pool.submit(_convert_file, self.data_dir, file_path, run_dir) for file_path in files]
+                    for file_path, future in zip(files, futures):
+                        file_runs, names, links = future.result()
+                        print(f"Processed {os.path.basename(file_path)}")
+                        runs.extend(file_runs)
+                        self.registry.update(names)
+                        self.pending_links.extend(links)
+
+            self.resolve_links()
+            self.triples.flush()
+            runs.extend(self.triples.runs)
+
+            # Serialize
+            output_path = os.path.join(rdf_dir, "elden_ring_full.nt")
+            if fmt == "turtle":
+                nt_path = os.path.join(run_dir, "merged.nt")
+                count = merge_runs(runs, nt_path)
+                graph = Graph()
+                graph.bind("er", ER)
+                graph.bind("schema", SCHEMA)
+                graph.parse(nt_path, format="nt")
+                output_path = os.path.join(rdf_dir, "elden_ring_full.ttl")
+                graph.serialize(destination=output_path, format="turtle")
+            else:
+                count = merge_runs(runs, output_path)
+        print(f"Conversion complete. Saved {count} triples to {output_path}")
+
+        report_path = os.path.join(os.path.dirname(output_path), "unresolved_links.json")
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump({kind: sorted(set(names)) for kind, names in sorted(self.unresolved.items())}, f, ensure_ascii=False, indent=2)
+        print(f"Unresolved link report saved to {report_path}")
+
+    def resolve_links(self):
+        """
+        Resolve queued cross-entity references against the registry.
+        Runs over the in-memory queue only; anything that cannot be linked
+        is recorded in self.unresolved (kind -> target names).
+        """
+        print(f"Resolving {len(self.pending_links)} links...")
+        for uri, kind, target in self.pending_links:
+            target_uri = self.registry.get(target)
+
+            if kind == 'location':
+                if not target_uri:
+                    # Create a stub location if not found
+                    target_uri = ER[clean_name(target)]
+                    self.triples.add((target_uri, RDF.type, ER.Location))
+                    self.triples.add((target_uri, RDFS.label, Literal(target)))
+                    self.unresolved[kind].append(target)
+                self.triples.add((uri, ER.locatedAt, target_uri))
+            elif not target_uri:
+                if kind == 'skill':
+                    # Skill is not an Ash of War we know of; keep the name
+                    self.triples.add((uri, ER.hasSkillName, Literal(target)))
+                self.unresolved[kind].append(target)
+            elif kind == 'skill':
+                self.triples.add((uri, ER.hasSkill, target_uri))
+            elif kind == 'drop':
+                self.triples.add((uri, ER.drops, target_uri))
+            elif kind == 'boss':
+                self.triples.add((uri, ER.droppedBy, target_uri))
+            elif kind == 'reward':
+                self.triples.add((uri, ER.grantsReward, target_uri))
+                self.triples.add((target_uri, ER.obtainedFrom, uri))
+
+        for kind, names in sorted(self.unresolved.items()):
+            print(f"  Unresolved {kind}: {len(names)}")
 
     def process_row(self, filename, row):
         name = row.get('name')
@@ -165,19 +304,19 @@ class EldenRingConverter:
             return
 
         name = name.strip()
-        uri = self.registry.get(name)
-        if not uri:
-            uri = ER[clean_name(name)] # Fallback
+        uri = ER[clean_name(name)]
+        if row.get('name'):
+            self.registry[name] = uri
 
         # Only add label/desc/image if it's the main entry (not an upgrade row)
         if filename != 'weapons_upgrades.csv':
-            self.graph.add((uri, RDFS.label, Literal(name)))
+            self.triples.add((uri, RDFS.label, Literal(name)))
             
             # Common fields
             if 'description' in row and row['description']:
-                self.graph.add((uri, SCHEMA.description, Literal(row['description'])))
+                self.triples.add((uri, SCHEMA.description, Literal(row['description'])))
             if 'image' in row and row['image']:
-                self.graph.add((uri, SCHEMA.image, Literal(row['image'])))
+                self.triples.add((uri, SCHEMA.image, Literal(row['image'])))
 
         # Dispatch based on filename/content
         if filename == 'weapons.csv':
@@ -193,32 +332,32 @@ class EldenRingConverter:
         elif filename == 'remembrances.csv':
             self.process_remembrance(uri, row)
         elif filename == 'locations.csv':
-            self.graph.add((uri, RDF.type, ER.Location))
+            self.triples.add((uri, RDF.type, ER.Location))
         elif filename == 'creatures.csv':
-            self.graph.add((uri, RDF.type, ER.Creature))
+            self.triples.add((uri, RDF.type, ER.Creature))
         elif filename == 'npcs.csv':
-            self.graph.add((uri, RDF.type, ER.NPC))
+            self.triples.add((uri, RDF.type, ER.NPC))
         elif filename == 'ashesOfWar.csv':
-            self.graph.add((uri, RDF.type, ER.AshOfWar))
+            self.triples.add((uri, RDF.type, ER.AshOfWar))
         elif filename == 'sorceries.csv':
-            self.graph.add((uri, RDF.type, ER.Sorcery))
+            self.triples.add((uri, RDF.type, ER.Sorcery))
         elif filename == 'incantations.csv':
-            self.graph.add((uri, RDF.type, ER.Incantation))
+            self.triples.add((uri, RDF.type, ER.Incantation))
         elif filename == 'spiritAshes.csv':
-            self.graph.add((uri, RDF.type, ER.SpiritAsh))
+            self.triples.add((uri, RDF.type, ER.SpiritAsh))
         else:
             # Generic Item fallback
-            self.graph.add((uri, RDF.type, ER.Item))
+            self.triples.add((uri, RDF.type, ER.Item))
 
     def process_weapon(self, uri, row):
         # Type mapping
         category = row.get('category')
         if category and category in self.weapon_category_map:
-            self.graph.add((uri, RDF.type, self.weapon_category_map[category]))
+            self.triples.add((uri, RDF.type, self.weapon_category_map[category]))
         else:
-            self.graph.add((uri, RDF.type, ER.Weapon))
+            self.triples.add((uri, RDF.type, ER.Weapon))
             if category:
-                self.graph.add((uri, ER.weaponCategory, Literal(category)))
+                self.triples.add((uri, ER.weaponCategory, Literal(category)))
 
         # Requirements
         reqs_str = row.get('requirements')
@@ -227,31 +366,26 @@ class EldenRingConverter:
             for stat, value in reqs.items():
                 try:
                     val_int = int(value)
-                    if stat == 'Str': self.graph.add((uri, ER.requiresStrength, Literal(val_int, datatype=XSD.integer)))
-                    elif stat == 'Dex': self.graph.add((uri, ER.requiresDexterity, Literal(val_int, datatype=XSD.integer)))
-                    elif stat == 'Int': self.graph.add((uri, ER.requiresIntelligence, Literal(val_int, datatype=XSD.integer)))
-                    elif stat == 'Fai': self.graph.add((uri, ER.requiresFaith, Literal(val_int, datatype=XSD.integer)))
-                    elif stat == 'Arc': self.graph.add((uri, ER.requiresArcane, Literal(val_int, datatype=XSD.integer)))
+                    if stat == 'Str': self.triples.add((uri, ER.requiresStrength, Literal(val_int, datatype=XSD.integer)))
+                    elif stat == 'Dex': self.triples.add((uri, ER.requiresDexterity, Literal(val_int, datatype=XSD.integer)))
+                    elif stat == 'Int': self.triples.add((uri, ER.requiresIntelligence, Literal(val_int, datatype=XSD.integer)))
+                    elif stat == 'Fai': self.triples.add((uri, ER.requiresFaith, Literal(val_int, datatype=XSD.integer)))
+                    elif stat == 'Arc': self.triples.add((uri, ER.requiresArcane, Literal(val_int, datatype=XSD.integer)))
                 except ValueError:
                     pass
 
         # Damage Type
         if row.get('damage type'):
-            self.graph.add((uri, ER.damageType, Literal(row['damage type'])))
+            self.triples.add((uri, ER.damageType, Literal(row['damage type'])))
         
         # Passive
         if row.get('passive effect'):
-            self.graph.add((uri, ER.passiveEffect, Literal(row['passive effect'])))
+            self.triples.add((uri, ER.passiveEffect, Literal(row['passive effect'])))
 
         # Skill
         if row.get('skill'):
-            skill_name = row['skill']
-            # Try to link to Ash of War if it exists
-            skill_uri = self.registry.get(skill_name)
-            if skill_uri:
-                self.graph.add((uri, ER.hasSkill, skill_uri))
-            else:
-                self.graph.add((uri, ER.hasSkillName, Literal(skill_name)))
+            # Linked to the Ash of War (or kept as a name) in resolve_links
+            self.pending_links.append((uri, 'skill', row['skill']))
 
     def process_weapon_upgrade(self, uri, row):
         # Only process base stats (Standard +0)
@@ -268,20 +402,20 @@ class EldenRingConverter:
                 value = value.strip()
                 if value == '-': continue
                 
-                if stat == 'Str': self.graph.add((uri, ER.scalingStrength, Literal(value)))
-                elif stat == 'Dex': self.graph.add((uri, ER.scalingDexterity, Literal(value)))
-                elif stat == 'Int': self.graph.add((uri, ER.scalingIntelligence, Literal(value)))
-                elif stat == 'Fai': self.graph.add((uri, ER.scalingFaith, Literal(value)))
-                elif stat == 'Arc': self.graph.add((uri, ER.scalingArcane, Literal(value)))
+                if stat == 'Str': self.triples.add((uri, ER.scalingStrength, Literal(value)))
+                elif stat == 'Dex': self.triples.add((uri, ER.scalingDexterity, Literal(value)))
+                elif stat == 'Int': self.triples.add((uri, ER.scalingIntelligence, Literal(value)))
+                elif stat == 'Fai': self.triples.add((uri, ER.scalingFaith, Literal(value)))
+                elif stat == 'Arc': self.triples.add((uri, ER.scalingArcane, Literal(value)))
 
     def process_armor(self, uri, row):
         armor_type = row.get('type')
-        if armor_type == 'helm': self.graph.add((uri, RDF.type, ER.Helm))
-        elif armor_type == 'chest armor': self.graph.add((uri, RDF.type, ER.ChestArmor)) # CSV usually says "chest armor" or similar? Need to check.
-        elif armor_type == 'gauntlets': self.graph.add((uri, RDF.type, ER.Gauntlets))
-        elif armor_type == 'leg armor': self.graph.add((uri, RDF.type, ER.LegArmor))
+        if armor_type == 'helm': self.triples.add((uri, RDF.type, ER.Helm))
+        elif armor_type == 'chest armor': self.triples.add((uri, RDF.type, ER.ChestArmor)) # CSV usually says "chest armor" or similar? Need to check.
+        elif armor_type == 'gauntlets': self.triples.add((uri, RDF.type, ER.Gauntlets))
+        elif armor_type == 'leg armor': self.triples.add((uri, RDF.type, ER.LegArmor))
         else:
-            self.graph.add((uri, RDF.type, ER.Armor))
+            self.triples.add((uri, RDF.type, ER.Armor))
         
         # Stats (Damage Negation)
         negation_str = row.get('damage negation')
@@ -300,30 +434,30 @@ class EldenRingConverter:
                 for key, val in stats.items():
                     try:
                         val_float = float(val)
-                        if key == 'Phy': self.graph.add((uri, ER.physicalNegation, Literal(val_float, datatype=XSD.float)))
-                        elif key == 'Mag': self.graph.add((uri, ER.magicNegation, Literal(val_float, datatype=XSD.float)))
-                        elif key == 'Fir': self.graph.add((uri, ER.fireNegation, Literal(val_float, datatype=XSD.float)))
-                        elif key == 'Lit': self.graph.add((uri, ER.lightningNegation, Literal(val_float, datatype=XSD.float)))
-                        elif key == 'Hol': self.graph.add((uri, ER.holyNegation, Literal(val_float, datatype=XSD.float)))
+                        if key == 'Phy': self.triples.add((uri, ER.physicalNegation, Literal(val_float, datatype=XSD.float)))
+                        elif key == 'Mag': self.triples.add((uri, ER.magicNegation, Literal(val_float, datatype=XSD.float)))
+                        elif key == 'Fir': self.triples.add((uri, ER.fireNegation, Literal(val_float, datatype=XSD.float)))
+                        elif key == 'Lit': self.triples.add((uri, ER.lightningNegation, Literal(val_float, datatype=XSD.float)))
+                        elif key == 'Hol': self.triples.add((uri, ER.holyNegation, Literal(val_float, datatype=XSD.float)))
                     except ValueError:
                         pass
             except:
                 pass
 
     def process_talisman(self, uri, row):
-        self.graph.add((uri, RDF.type, ER.Talisman))
+        self.triples.add((uri, RDF.type, ER.Talisman))
         if row.get('effect'):
-            self.graph.add((uri, ER.effect, Literal(row['effect'])))
+            self.triples.add((uri, ER.effect, Literal(row['effect'])))
         if row.get('weight'):
             try:
-                self.graph.add((uri, ER.weight, Literal(float(row['weight']), datatype=XSD.float)))
+                self.triples.add((uri, ER.weight, Literal(float(row['weight']), datatype=XSD.float)))
             except:
                 pass
 
     def process_boss(self, uri, row):
-        self.graph.add((uri, RDF.type, ER.Boss))
+        self.triples.add((uri, RDF.type, ER.Boss))
         if row.get('HP'):
-            self.graph.add((uri, ER.healthPoints, Literal(row['HP'])))
+            self.triples.add((uri, ER.healthPoints, Literal(row['HP'])))
         
         # Drops & Locations
         # Format: "{'Location Name': ['Drop 1', 'Drop 2']}"
@@ -335,47 +469,23 @@ class EldenRingConverter:
                     # Link Location
                     # Clean location name (remove trailing colon if present)
                     loc_clean = loc_name.strip().rstrip(':')
-                    loc_uri = self.registry.get(loc_clean)
-                    
-                    if not loc_uri:
-                        # Create a stub location if not found
-                        loc_uri = ER[clean_name(loc_clean)]
-                        self.graph.add((loc_uri, RDF.type, ER.Location))
-                        self.graph.add((loc_uri, RDFS.label, Literal(loc_clean)))
+                    self.pending_links.append((uri, 'location', loc_clean))
                     
-                    self.graph.add((uri, ER.locatedAt, loc_uri))
-                    
-                    # Link Drops
+                    # Link Drops (rune amounts like "120,000" simply fail to resolve)
                     for item_name in items:
-                        # Clean item name (sometimes has amounts like "120,000")
-                        # If it looks like a number, it's probably runes, ignore for now or add as runes
-                        if any(char.isdigit() for char in item_name) and "Runes" not in item_name and "Bell Bearing" not in item_name:
-                             # Heuristic: if it's just a number string like '120,000', skip
-                             # But 'Smithing Stone [1]' has digits.
-                             # Let's just try to look it up.
-                             pass
-                        
-                        item_uri = self.registry.get(item_name)
-                        if item_uri:
-                            self.graph.add((uri, ER.drops, item_uri))
-                        else:
-                            # Maybe create a stub drop?
-                            pass
+                        self.pending_links.append((uri, 'drop', item_name))
 
             except Exception as e:
                 # print(f"Error parsing drops for {row['name']}: {e}")
                 pass
 
     def process_remembrance(self, uri, row):
-        self.graph.add((uri, RDF.type, ER.Remembrance))
+        self.triples.add((uri, RDF.type, ER.Remembrance))
         
         # Link to Boss
         boss_name = row.get('boss')
         if boss_name:
-            boss_uri = self.registry.get(boss_name.strip())
-            if boss_uri:
-                self.graph.add((uri, ER.droppedBy, boss_uri))
-                # Also inverse link if needed, but droppedBy is good
+            self.pending_links.append((uri, 'boss', boss_name.strip()))
         
         # Rewards (Option 1 & 2)
         for col in ['option 1', 'option 2']:
@@ -392,21 +502,25 @@ class EldenRingConverter:
                 # "Weapon: ", "Sorcery: ", "Incantation: ", "Talisman: ", "Ash of War: "
                 clean_reward = re.sub(r'^(Weapon|Sorcery|Incantation|Talisman|Ash of War|Ash of War:)\s*:?\s*', '', reward, flags=re.IGNORECASE)
                 
-                reward_uri = self.registry.get(clean_reward)
-                if reward_uri:
-                    self.graph.add((uri, ER.grantsReward, reward_uri))
-                    # Also link the item back to the remembrance/boss?
-                    # "obtainedFrom"
-                    self.graph.add((reward_uri, ER.obtainedFrom, uri))
-                else:
-                    # Try fuzzy match or just log?
-                    # For now, just skip or create stub?
-                    # Let's create a stub if we can't find it, to ensure connectivity
-                    # But registry should have it if it's in other files.
-                    pass
+                # grantsReward / obtainedFrom are added in resolve_links
+                self.pending_links.append((uri, 'reward', clean_reward))
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert Elden Ring CSV data to RDF.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes for per-file conversion. Default: all cores (1 = no pool)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["nt", "turtle"],
+        default="nt",
+        help="Output format. Default: nt (streamed, sorted N-Triples)",
+    )
+    args = parser.parse_args()
+
     converter = EldenRingConverter("data")
-    converter.build_registry()
-    converter.convert()
+    converter.convert(workers=args.workers, fmt=args.format)
 
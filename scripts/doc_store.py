@@ -0,0 +1,113 @@
+import os
+import zlib
+
+import numpy as np
+
+
+FIELDS = ("subject", "title", "text")
+DATA_FILE = "docs.bin"
+OFFSETS_FILE = "docs_offsets.npy"
+# zlib preset dictionary for compressed texts; empty when texts are stored raw.
+ZDICT_FILE = "docs_zdict.bin"
+ZDICT_SIZE = 32 * 1024  # zlib's window; a longer dictionary is truncated to its tail
+
+
+def _train_zdict(texts: list[bytes], size: int = ZDICT_SIZE) -> bytes:
+    """
+    Preset dictionary from evenly spaced sample texts. Docs repeat the same
+    predicate URIs and labels, which then compress even in a short text.
+    """
+    step = max(1, len(texts) // 256)
+    return b"".join(texts[::step])[-size:]
+
+
+def _compress(data: bytes, zdict: bytes) -> bytes:
+    c = zlib.compressobj(9, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY, zdict)
+    return c.compress(data) + c.flush()
+
+
+def write_doc_store(docs: list[dict], out_dir: str, compress: bool = False) -> None:
+    """
+    Write docs as one blob plus an offsets array with an entry per
+    (doc, field), so readers can memory-map it and decode single fields.
+    With compress, each text is zlib-compressed on its own against a shared
+    preset dictionary, so one text still decodes without the others;
+    subjects and titles, read for every neighbour and hit, stay raw UTF-8.
+    """
+    texts = [d.get("text", "").encode("utf-8") for d in docs]
+    zdict = _train_zdict(texts) if compress and texts else b""
+    if zdict:
+        texts = [_compress(t, zdict) for t in texts]
+    chunks = [
+        texts[i] if field == "text" else d.get(field, "").encode("utf-8")
+        for i, d in enumerate(docs)
+        for field in FIELDS
+    ]
+    offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in chunks], out=offsets[1:])
+    with open(os.path.join(out_dir, DATA_FILE), "wb") as f:
+        f.write(b"".join(chunks))
+    np.save(os.path.join(out_dir, OFFSETS_FILE), offsets)
+    # Always written, so a raw build replaces the dictionary of an earlier compressed one.
+    with open(os.path.join(out_dir, ZDICT_FILE), "wb") as f:
+        f.write(zdict)
+
+
+class _Column:
+    """Read-only sequence view over one field of a DocStore."""
+
+    def __init__(self, store: "DocStore", field: str):
+        self._store = store
+        self._field = FIELDS.index(field)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __getitem__(self, i: int) -> str:
+        return self._store._field(i, self._field)
+
+
+class DocStore:
+    """
+    Memory-mapped, read-only view of a store written by write_doc_store.
+    Pages are shared by every process that opens the same files, and only
+    the fields that are read get decoded (and decompressed).
+    """
+
+    def __init__(self, index_dir: str):
+        self._offsets = np.load(os.path.join(index_dir, OFFSETS_FILE), mmap_mode="r")
+        if self._offsets[-1]:
+            self._data = np.memmap(os.path.join(index_dir, DATA_FILE), dtype=np.uint8, mode="r")
+        else:
+            self._data = np.zeros(0, dtype=np.uint8)  # np.memmap cannot map an empty file
+        zdict_path = os.path.join(index_dir, ZDICT_FILE)
+        self._zdict = b""
+        if os.path.exists(zdict_path):  # absent in stores written before compression
+            with open(zdict_path, "rb") as f:
+                self._zdict = f.read()
+
+    @staticmethod
+    def exists(index_dir: str) -> bool:
+        return all(os.path.exists(os.path.join(index_dir, name)) for name in (DATA_FILE, OFFSETS_FILE))
+
+    @property
+    def compressed(self) -> bool:
+        return bool(self._zdict)
+
+    def __len__(self) -> int:
+        return (len(self._offsets) - 1) // len(FIELDS)
+
+    def _field(self, i: int, field: int) -> str:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        k = i * len(FIELDS) + field
+        raw = self._data[self._offsets[k]:self._offsets[k + 1]].tobytes()
+        if self._zdict and FIELDS[field] == "text":
+            raw = zlib.decompressobj(zdict=self._zdict).decompress(raw)
+        return raw.decode("utf-8")
+
+    def __getitem__(self, i: int) -> dict:
+        return {name: self._field(i, f) for f, name in enumerate(FIELDS)}
+
+    def column(self, field: str) -> _Column:
+        return _Column(self, field)
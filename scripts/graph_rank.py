@@ -0,0 +1,50 @@
+import numpy as np
+from scipy import sparse
+
+
+def transition_matrix(indptr: np.ndarray, indices: np.ndarray, restart: float) -> sparse.csr_matrix:
+    """
+    (1 - restart) x the random-walk matrix of a CSR graph (see
+    build_adjacency): row i spreads doc i's mass evenly over its neighbours.
+    Built straight from the index arrays; no copy of the structure.
+    """
+    n = len(indptr) - 1
+    degree = np.diff(indptr)
+    weights = np.repeat((1 - restart) / np.maximum(degree, 1), degree).astype(np.float32)
+    return sparse.csr_matrix((weights, np.asarray(indices), np.asarray(indptr)), shape=(n, n))
+
+
+def seed_matrix(n_docs: int, seeds: list[list[tuple[int, float]]]) -> sparse.csr_matrix:
+    """(n_queries, n_docs) restart distributions: row q spreads 1 over seeds[q]'s (doc, weight) pairs."""
+    rows, cols, weights = [], [], []
+    for q, pairs in enumerate(seeds):
+        total = sum(w for _, w in pairs) or 1.0
+        for doc, w in pairs:
+            rows.append(q)
+            cols.append(doc)
+            weights.append(w / total)
+    return sparse.csr_matrix((np.array(weights, dtype=np.float32), (rows, cols)), shape=(len(seeds), n_docs))
+
+
+def personalized_pagerank(
+    walk: sparse.csr_matrix,
+    seeds: sparse.csr_matrix,
+    restart: float,
+    iterations: int,
+) -> sparse.csr_matrix:
+    """
+    `iterations` steps of r = restart * s + r @ walk from r = s, for every
+    row (one query's seeds) at once; walk comes from transition_matrix with
+    the same restart. The state stays sparse, row by query, so each step
+    only touches the edges of docs already reached: the cost follows the
+    few-hop neighbourhood of the seeds, not the size of the graph. Returns
+    the mass that arrived over edges in the last step (indices sorted), so
+    seeds are not rewarded just for being seeds.
+    """
+    base = seeds * restart
+    r = spread = seeds
+    for _ in range(iterations):
+        spread = r @ walk
+        r = base + spread
+    spread.sort_indices()
+    return spread
@@ -1,3 +1,7 @@
+import argparse
+import heapq
+import os
+
 # Expanded Mappings to Wikidata (The "5-Star" Requirement)
 links = {
     # --- CONCEPTS ---
@@ -43,30 +47,89 @@ links = {
     "er:AcademyOfRayaLucaria": "http://www.wikidata.org/entity/Q111174085"
 }
 
-# 1. Read Original
-input_file = "rdf/elden_ring_full.ttl"
-output_file = "rdf/elden_ring_linked.ttl"
+ER_URI = "http://example.org/elden_ring/"
+OWL_SAME_AS = "<http://www.w3.org/2002/07/owl#sameAs>"
+
+NT_INPUT = "rdf/elden_ring_full.nt"
+NT_OUTPUT = "rdf/elden_ring_fast_linked.nt"
+TURTLE_INPUT = "rdf/elden_ring_full.ttl"
+TURTLE_OUTPUT = "rdf/elden_ring_linked.ttl"
+
+
+def link_nt(nt_input: str, nt_output: str) -> None:
+    # Converter output is already sorted N-Triples, so stream it through and
+    # merge the (sorted) sameAs lines in without loading the graph.
+    link_lines = sorted(
+        f"<{ER_URI}{local.split(':', 1)[1]}> {OWL_SAME_AS} <{remote}> .\n"
+        for local, remote in links.items()
+    )
+    print(f"Streaming {nt_input} and injecting {len(links)} Wikidata links...")
+    with open(nt_input, "r", encoding="utf-8") as f_in, open(nt_output, "w", encoding="utf-8") as f_out:
+        last = None
+        for line in heapq.merge(f_in, link_lines):
+            if line != last:
+                f_out.write(line)
+                last = line
+    print(f"Success! Saved to '{nt_output}'.")
 
-print(f"Reading {input_file}...")
-try:
+
+def link_turtle(input_file: str, output_file: str) -> None:
+    # 1. Read Original
+    print(f"Reading {input_file}...")
     with open(input_file, "r", encoding="utf-8") as f_in:
         content = f_in.read()
-except FileNotFoundError:
-    print(f"{input_file} not found. Run converter.py first.")
-    exit()
-
-# 2. Append Links
-print(f"Injecting {len(links)} Wikidata links...")
-with open(output_file, "w", encoding="utf-8") as f_out:
-    f_out.write(content)
-    
-    f_out.write("\n\n# --- LINKED DATA BRIDGE (RUBRIC STEP 7) ---\n")
-    f_out.write("@prefix owl: <http://www.w3.org/2002/07/owl#> .\n")
-    
-    for local, remote in links.items():
-        # IMPORTANT: Use the exact prefixed subject used in the graph (e.g., boss:..., npc:...)
-        # so the owl:sameAs statement attaches to an existing entity instead of creating a new URI.
-        line = f"{local} owl:sameAs <{remote}> .\n"
-        f_out.write(line)
-
-print(f"Success! Saved to '{output_file}'.")
\ No newline at end of file
+
+    # 2. Append Links
+    print(f"Injecting {len(links)} Wikidata links...")
+    with open(output_file, "w", encoding="utf-8") as f_out:
+        f_out.write(content)
+
+        f_out.write("\n\n# --- LINKED DATA BRIDGE (RUBRIC STEP 7) ---\n")
+        f_out.write("@prefix owl: <http://www.w3.org/2002/07/owl#> .\n")
+
+        for local, remote in links.items():
+            # IMPORTANT: Use the exact prefixed subject used in the graph (e.g., boss:..., npc:...)
+            # so the owl:sameAs statement attaches to an existing entity instead of creating a new URI.
+            line = f"{local} owl:sameAs <{remote}> .\n"
+            f_out.write(line)
+
+    print(f"Success! Saved to '{output_file}'.")
+
+
+def _newest_format() -> str | None:
+    """Format of the most recent converter.py output, or None if there is none."""
+    inputs = [
+        (os.path.getmtime(path), fmt)
+        for fmt, path in (("nt", NT_INPUT), ("turtle", TURTLE_INPUT))
+        if os.path.exists(path)
+    ]
+    return max(inputs)[1] if inputs else None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Add Wikidata owl:sameAs links to the converted graph.")
+    parser.add_argument(
+        "--format",
+        choices=["nt", "turtle"],
+        default=None,
+        help=f"Input to link: nt ({NT_INPUT}) or turtle ({TURTLE_INPUT}). Default: whichever was written last",
+    )
+    args = parser.parse_args()
+
+    fmt = args.format or _newest_format()
+    if fmt is None:
+        print(f"Neither {NT_INPUT} nor {TURTLE_INPUT} found. Run converter.py first.")
+        return 1
+    input_file = NT_INPUT if fmt == "nt" else TURTLE_INPUT
+    if not os.path.exists(input_file):
+        print(f"{input_file} not found. Run converter.py --format {fmt} first.")
+        return 1
+    if fmt == "nt":
+        link_nt(NT_INPUT, NT_OUTPUT)
+    else:
+        link_turtle(TURTLE_INPUT, TURTLE_OUTPUT)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_QUERIES = [
+    "What does Moonveil require to wield?",
+    "Where is Godrick the Grafted?",
+    "Which weapons scale with strength and dexterity?",
+    "What does Rennala drop?",
+    "What is the Sacred Tear used for?",
+    "Which boss drops the Remembrance of the Grafted?",
+    "Tell me about the Rivers of Blood katana",
+    "Where do I find Malenia?",
+]
+
+# Stub configuration for --spawn: no weights, no GPU (see scripts/stub_models.py).
+STUB_ENV = {"ELDENRAG_STUB_MODELS": "1", "ELDENRAG_RELOAD_INTERVAL": "0"}
+
+
+def _request(url: str, payload: dict | None = None, timeout: float = 120.0) -> tuple[int, dict | None]:
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def _wait_ready(base_url: str, proc: subprocess.Popen | None, timeout: float) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            _request(base_url + "/api/metrics", timeout=2)
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise TimeoutError(f"server at {base_url} not ready after {timeout:.0f}s")
+
+
+def _spawn(port: int, extra_env: dict[str, str]) -> subprocess.Popen:
+    env = dict(os.environ, **STUB_ENV, ELDENRAG_PORT=str(port), **extra_env)
+    print(f"Spawning web_server.py (stub models) on port {port}" + "".join(f" {k}={v}" for k, v in sorted(extra_env.items())))
+    return subprocess.Popen([sys.executable, "web_server.py"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run_load(base_url: str, queries: list[str], concurrency: int, duration: float, endpoint: str) -> dict:
+    """
+    Keep `concurrency` requests in flight for `duration` seconds, cycling
+    through queries. Returns per-request latencies, status counts and the
+    server's event-loop lag over the run.
+    """
+    _request(base_url + "/api/metrics?reset=1")
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    lock = threading.Lock()
+    counter = iter(range(1 << 62))
+    stop_at = time.perf_counter() + duration
+
+    def worker() -> None:
+        while time.perf_counter() < stop_at:
+            query = queries[next(counter) % len(queries)]
+            start = time.perf_counter()
+            try:
+                status, _ = _request(base_url + endpoint, {"query": query})
+            except OSError:
+                status = 0  # connection error / timeout
+            elapsed = time.perf_counter() - start
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - start
+
+    _, server = _request(base_url + "/api/metrics")
+    return {"latencies": latencies, "statuses": statuses, "wall_s": wall, "server": server or {}}
+
+
+def report(result: dict, concurrency: int) -> None:
+    lat = sorted(result["latencies"])
+    ok = len(lat)
+    total = sum(result["statuses"].values())
+
+    def pct(q: float) -> float:
+        return lat[min(ok - 1, int(q * ok))] * 1000 if ok else 0.0
+
+    print(f"\nConcurrency:  {concurrency}")
+    print(f"Requests:     {total} ({ok} ok) in {result['wall_s']:.1f}s")
+    statuses = ", ".join(f"{code or 'conn error'}: {n}" for code, n in sorted(result["statuses"].items()))
+    print(f"Statuses:     {statuses}")
+    print(f"Throughput:   {ok / result['wall_s']:.2f} req/s")
+    if ok:
+        print(f"Latency ms:   p50 {pct(0.50):.1f}  p90 {pct(0.90):.1f}  p99 {pct(0.99):.1f}  "
+              f"max {lat[-1] * 1000:.1f}  mean {statistics.mean(lat) * 1000:.1f}")
+    lag = result["server"].get("event_loop_lag_ms")
+    if lag:
+        print(f"Loop lag ms:  p50 {lag['p50']:.1f}  p99 {lag['p99']:.1f}  max {lag['max']:.1f}  "
+              f"({lag['samples']} samples, pid {result['server'].get('pid')})")
+    for name, queue in result["server"].get("queues", {}).items():
+        print(f"Queue {name + ':':<7} wait ms p50 {queue['wait_ms_p50']:.1f}  p99 {queue['wait_ms_p99']:.1f}  "
+              f"service {queue['service_ms']:.1f} ms  {queue['completed']} done / {queue['rejected']} rejected")
+    cache = result["server"].get("cache")
+    if cache:
+        print(f"Cache:        hit rate {cache['hit_rate']:.1%} ({cache['hits']} hits / {cache['misses']} misses)")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Drive /api/chat at a target concurrency and report throughput, tail latency and event-loop lag."
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Server base URL. Default: http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", default="/api/chat", help="POST endpoint taking {query}. Default: /api/chat")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8], help="In-flight requests; several values run in turn. Default: 8")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per concurrency level. Default: 20")
+    parser.add_argument("--queries", default=None, help="Optional file with one query per line.")
+    parser.add_argument(
+        "--spawn",
+        action="store_true",
+        help="Start web_server.py with stub models (ELDENRAG_STUB_MODELS=1) on the --url port for the run.",
+    )
+    parser.add_argument(
+        "--env",
+        nargs="*",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Extra environment for --spawn, e.g. ELDENRAG_STUB_GENERATE_MS=200 ELDENRAG_CACHE_SIZE=0",
+    )
+    parser.add_argument("--startup-timeout", type=float, default=300.0, help="Seconds to wait for the server. Default: 300")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    if not queries:
+        parser.error("No queries.")
+
+    proc = None
+    if args.spawn:
+        port = int(args.url.rsplit(":", 1)[-1].split("/")[0])
+        proc = _spawn(port, dict(kv.split("=", 1) for kv in args.env))
+    try:
+        _wait_ready(args.url, proc, args.startup_timeout)
+        for concurrency in args.concurrency:
+            report(run_load(args.url, queries, concurrency, args.duration, args.endpoint), concurrency)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,18 +1,33 @@
 from rdflib import Graph
+import os
 import time
 
-print("Reading Turtle file...")
-start = time.time()
+from triple_store import build_store
 
-g = Graph()
-try:
-    g.parse("rdf/elden_ring_linked.ttl", format="turtle")
-except Exception as e:
-    print(f"Error: {e}")
-    exit()
+# linker.py already writes N-Triples when converter.py streamed them (the default);
+# the Turtle conversion is only needed for the Turtle path.
+if os.path.exists("rdf/elden_ring_fast_linked.nt") and (
+    not os.path.exists("rdf/elden_ring_linked.ttl")
+    or os.path.getmtime("rdf/elden_ring_fast_linked.nt") >= os.path.getmtime("rdf/elden_ring_linked.ttl")
+):
+    print("rdf/elden_ring_fast_linked.nt is up to date. Skipping Turtle conversion.")
+else:
+    print("Reading Turtle file...")
+    start = time.time()
 
-print(f"Loaded {len(g)} triples in {time.time() - start:.2f}s.")
-print("Converting to N-Triples (Fast Format)...")
+    g = Graph()
+    try:
+        g.parse("rdf/elden_ring_linked.ttl", format="turtle")
+    except Exception as e:
+        print(f"Error: {e}")
+        exit()
 
-g.serialize(destination="rdf/elden_ring_fast_linked.nt", format="nt")
-print("Done. Use 'rdf/elden_ring_fast_linked.nt' for validation.")
\ No newline at end of file
+    print(f"Loaded {len(g)} triples in {time.time() - start:.2f}s.")
+    print("Converting to N-Triples (Fast Format)...")
+
+    g.serialize(destination="rdf/elden_ring_fast_linked.nt", format="nt")
+    print("Done. Use 'rdf/elden_ring_fast_linked.nt' for validation.")
+
+# Dictionary-encoded, memory-mappable store for rdflib-free pattern queries
+print("Compiling triple store...")
+build_store("rdf/elden_ring_fast_linked.nt", "rdf/elden_ring_store")
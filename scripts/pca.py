@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+
+
+def _paths(index_dir: str, dims: int) -> tuple[str, str, str]:
+    return tuple(os.path.join(index_dir, f"pca{dims}_{name}.npy") for name in ("embeddings", "components", "mean"))
+
+
+def fit_pca(embeddings: np.ndarray, dims: int) -> tuple[np.ndarray, np.ndarray]:
+    """Top `dims` principal axes of the embedding matrix: (components (dims, D), mean (D,))."""
+    mean = embeddings.mean(axis=0)
+    # Eigenvectors of the D x D covariance; cheaper than an SVD of the n x D matrix when n >> D.
+    centered = embeddings - mean
+    cov = centered.T @ centered
+    eigvals, eigvecs = np.linalg.eigh(cov.astype(np.float64))
+    components = eigvecs[:, np.argsort(eigvals)[::-1][:dims]].T
+    return components.astype(np.float32), mean.astype(np.float32)
+
+
+def project(x: np.ndarray, components: np.ndarray, mean: np.ndarray) -> np.ndarray:
+    """Project rows into the reduced space and L2-normalize them, so dot products are cosines."""
+    reduced = (x - mean) @ components.T
+    norms = np.linalg.norm(reduced, axis=-1, keepdims=True)
+    return (reduced / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def save_pca(index_dir: str, embeddings: np.ndarray, components: np.ndarray, mean: np.ndarray) -> None:
+    emb_path, comp_path, mean_path = _paths(index_dir, components.shape[0])
+    np.save(emb_path, project(embeddings, components, mean))
+    np.save(comp_path, components)
+    np.save(mean_path, mean)
+
+
+def load_pca(index_dir: str, dims: int) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+    """(reduced embeddings, components, mean), memory-mapped, or None if not built."""
+    paths = _paths(index_dir, dims)
+    if not all(os.path.exists(p) for p in paths):
+        return None
+    return tuple(np.load(p, mmap_mode="r") for p in paths)
+
+
+def search(
+    queries: np.ndarray,
+    embeddings: np.ndarray,
+    top_k: int,
+    reduced: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None,
+    pool: int = 0,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k cosine search; queries and embeddings are L2-normalized. With
+    `reduced` (from load_pca), the first stage scans the reduced matrix for
+    `pool` candidates per query, which are rescored with the full vectors.
+    Returns (ids, scores), both (n_queries, k), best first.
+    """
+    top_k = min(top_k, len(embeddings))
+    if reduced is None:
+        scores = queries @ embeddings.T
+        candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        cand_scores = np.take_along_axis(scores, candidates, axis=1)
+    else:
+        reduced_emb, components, mean = reduced
+        pool = min(max(pool, top_k), len(embeddings))
+        coarse = project(queries, components, mean) @ reduced_emb.T
+        # Sorted ids keep the gather from the (possibly memory-mapped) full matrix sequential.
+        pool_ids = np.sort(np.argpartition(-coarse, pool - 1, axis=1)[:, :pool], axis=1)
+        # Rescore the pool at full precision; only these rows of the full matrix are touched.
+        full = np.einsum("qd,qkd->qk", queries, embeddings[pool_ids])
+        keep = np.argpartition(-full, top_k - 1, axis=1)[:, :top_k]
+        candidates = np.take_along_axis(pool_ids, keep, axis=1)
+        cand_scores = np.take_along_axis(full, keep, axis=1)
+    order = np.argsort(-cand_scores, axis=1)
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(cand_scores, order, axis=1)
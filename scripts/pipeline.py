@@ -0,0 +1,207 @@
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+STATE_PATH = ".pipeline_state.json"
+
+
+def _stages(retriever_id: str) -> list[dict]:
+    """Pipeline DAG. Paths are relative to the repo root; directories hash recursively."""
+    return [
+        {
+            "name": "schema",
+            "cmd": ["scripts/schema.py"],
+            "inputs": ["scripts/schema.py"],
+            "outputs": ["rdf/elden_ring_schema.ttl"],
+            "deps": [],
+        },
+        {
+            "name": "convert",
+            "cmd": ["scripts/converter.py"],
+            "inputs": ["scripts/converter.py", "data"],
+            "outputs": ["rdf/elden_ring_full.nt"],
+            "deps": [],
+        },
+        {
+            "name": "link",
+            "cmd": ["scripts/linker.py", "--format", "nt"],
+            "inputs": ["scripts/linker.py", "rdf/elden_ring_full.nt"],
+            "outputs": ["rdf/elden_ring_fast_linked.nt"],
+            "deps": ["convert"],
+        },
+        {
+            "name": "store",
+            "cmd": ["scripts/optimize.py"],
+            "inputs": ["scripts/optimize.py", "scripts/triple_store.py", "rdf/elden_ring_fast_linked.nt"],
+            "outputs": ["rdf/elden_ring_store"],
+            "deps": ["link"],
+        },
+        {
+            "name": "sqlite",
+            "cmd": ["scripts/sqlite_store.py"],
+            "inputs": ["scripts/sqlite_store.py", "rdf/elden_ring_fast_linked.nt"],
+            "outputs": ["rdf/elden_ring.sqlite"],
+            "deps": ["link"],
+        },
+        {
+            "name": "index",
+            # --reuse only re-embeds docs whose text changed since the last build.
+            "cmd": ["scripts/build_rag_index.py", "--retriever", retriever_id, "--reuse"],
+            "inputs": ["scripts/build_rag_index.py", "rdf/elden_ring_fast_linked.nt"],
+            "outputs": ["rag_index"],
+            "deps": ["link"],
+        },
+    ]
+
+
+def _hash_path(path: str) -> str | None:
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha256()
+    if os.path.isdir(path):
+        files = []
+        for root, _, names in os.walk(path):
+            files.extend(os.path.join(root, n) for n in names)
+        for file_path in sorted(files):
+            h.update(file_path.replace("\\", "/").encode("utf-8"))
+            h.update((_hash_path(file_path) or "").encode("utf-8"))
+        return h.hexdigest()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _fingerprint(stage: dict, paths: list[str]) -> dict:
+    return {"cmd": stage["cmd"], "hashes": {p: _hash_path(p) for p in paths}}
+
+
+def _load_state() -> dict:
+    if not os.path.exists(STATE_PATH):
+        return {}
+    with open(STATE_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_state(state: dict) -> None:
+    with open(STATE_PATH, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def _is_fresh(stage: dict, state: dict) -> bool:
+    prev = state.get(stage["name"])
+    if not prev:
+        return False
+    if prev.get("inputs") != _fingerprint(stage, stage["inputs"]):
+        return False
+    outputs = _fingerprint(stage, stage["outputs"])
+    if any(h is None for h in outputs["hashes"].values()):
+        return False
+    return prev.get("outputs") == outputs
+
+
+def _run_stage(stage: dict) -> tuple[int, float]:
+    start = time.time()
+    proc = subprocess.run([sys.executable] + stage["cmd"])
+    return proc.returncode, time.time() - start
+
+
+def run_pipeline(stages: list[dict], force: bool, jobs: int) -> dict[str, tuple[str, float]]:
+    """
+    Run stages in dependency order, skipping those whose input and output
+    hashes match the last successful run. Stages whose dependencies are all
+    satisfied run concurrently (up to `jobs` at a time).
+    """
+    state = _load_state()
+    by_name = {s["name"]: s for s in stages}
+    results: dict[str, tuple[str, float]] = {}
+    pending = list(stages)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for stage in list(pending):
+                dep_status = [results.get(d, (None,))[0] for d in stage["deps"]]
+                if any(s in ("failed", "blocked") for s in dep_status):
+                    results[stage["name"]] = ("blocked", 0.0)
+                    pending.remove(stage)
+                    continue
+                if not all(s in ("ran", "skipped") for s in dep_status):
+                    continue
+                pending.remove(stage)
+                if not force and _is_fresh(stage, state):
+                    print(f"[pipeline] {stage['name']}: up to date, skipping")
+                    results[stage["name"]] = ("skipped", 0.0)
+                    continue
+                print(f"[pipeline] {stage['name']}: running {' '.join(stage['cmd'])}")
+                inputs = _fingerprint(stage, stage["inputs"])
+                running[pool.submit(_run_stage, stage)] = (stage["name"], inputs)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, inputs = running.pop(future)
+                code, elapsed = future.result()
+                if code == 0:
+                    results[name] = ("ran", elapsed)
+                    state[name] = {
+                        "inputs": inputs,
+                        "outputs": _fingerprint(by_name[name], by_name[name]["outputs"]),
+                    }
+                    _save_state(state)
+                else:
+                    print(f"[pipeline] {name}: failed with exit code {code}")
+                    results[name] = ("failed", elapsed)
+                    state.pop(name, None)
+                    _save_state(state)
+
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Incrementally rebuild the graph, triple store and RAG index (schema, converter -> linker -> optimize / build_rag_index)."
+    )
+    parser.add_argument(
+        "--retriever",
+        default="BAAI/bge-base-en-v1.5",
+        help="SentenceTransformer model id for the index stage. Default: BAAI/bge-base-en-v1.5",
+    )
+    parser.add_argument("--force", action="store_true", help="Run every stage even if its inputs are unchanged.")
+    parser.add_argument("--jobs", type=int, default=2, help="Max stages to run concurrently. Default: 2")
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        default=None,
+        help="Only consider these stages (dependencies outside the list are assumed up to date).",
+    )
+    args = parser.parse_args()
+
+    stages = _stages(args.retriever)
+    if args.stages:
+        unknown = set(args.stages) - {s["name"] for s in stages}
+        if unknown:
+            parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+        stages = [dict(s, deps=[d for d in s["deps"] if d in args.stages]) for s in stages if s["name"] in args.stages]
+
+    start = time.time()
+    results = run_pipeline(stages, force=args.force, jobs=args.jobs)
+
+    print("\nStage      Status     Time")
+    for stage in stages:
+        status, elapsed = results.get(stage["name"], ("blocked", 0.0))
+        print(f"{stage['name']:<10} {status:<10} {elapsed:6.2f}s")
+    print(f"Total: {time.time() - start:.2f}s")
+
+    return 1 if any(status in ("failed", "blocked") for status, _ in results.values()) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
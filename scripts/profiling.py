@@ -0,0 +1,65 @@
+import cProfile
+import os
+import pstats
+import threading
+import time
+
+# cProfile hooks the interpreter per thread; one profiled call at a time keeps traces readable.
+_lock = threading.Lock()
+
+
+def _write_ring(profiler: cProfile.Profile, out_dir: str, keep: int) -> str:
+    """Dump the profile into out_dir and delete the oldest files beyond `keep`."""
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{time.time_ns()}_{os.getpid()}.prof")
+    profiler.dump_stats(path)
+    files = sorted(f for f in os.listdir(out_dir) if f.endswith(".prof"))
+    for name in files[:max(0, len(files) - keep)]:
+        try:
+            os.remove(os.path.join(out_dir, name))
+        except OSError:
+            pass  # another worker pruned it first
+    return path
+
+
+def _summary(stats: pstats.Stats, stages: dict[str, str], top: int) -> dict:
+    """Cumulative time of each stage function, plus the `top` functions by own time."""
+    by_name: dict[str, float] = {}
+    rows = []
+    for (file, line, func), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        by_name[func] = max(by_name.get(func, 0.0), cumtime)
+        rows.append((tottime, cumtime, calls, f"{os.path.basename(file)}:{line}({func})"))
+    rows.sort(reverse=True)
+    return {
+        "stages_ms": {stage: round(by_name[func] * 1000, 3) for stage, func in stages.items() if func in by_name},
+        "top": [
+            {"function": name, "calls": calls, "self_ms": round(tottime * 1000, 3), "cumulative_ms": round(cumtime * 1000, 3)}
+            for tottime, cumtime, calls, name in rows[:top]
+        ],
+    }
+
+
+def profile_call(fn, *args, stages: dict[str, str], out_dir: str, keep: int, top: int = 15):
+    """
+    Run fn(*args) under cProfile. Returns (result, summary); the summary has
+    the wall time, per-stage cumulative times (stage name -> function name),
+    the top functions by own time and the path of the saved .prof file
+    (open with pstats or snakeviz). If another call is being profiled, fn
+    runs unprofiled and the summary says so.
+    """
+    if not _lock.acquire(blocking=False):
+        return fn(*args), {"skipped": "another request is being profiled"}
+    try:
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            result = fn(*args)
+        finally:
+            profiler.disable()
+        wall_ms = (time.perf_counter() - start) * 1000
+        summary = {"wall_ms": round(wall_ms, 3), **_summary(pstats.Stats(profiler), stages, top)}
+        summary["file"] = _write_ring(profiler, out_dir, keep)
+        return result, summary
+    finally:
+        _lock.release()
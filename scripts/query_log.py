@@ -0,0 +1,59 @@
+import json
+import os
+import threading
+from collections import Counter
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class QueryLog:
+    """
+    Hit counts of (normalized) queries, merged into a JSON file of
+    {query: count} by flush(). Several server processes may share the file:
+    each adds the counts it gathered since its last flush under an exclusive
+    lock (POSIX only; Windows runs a single process), and the file keeps
+    only the `max_entries` most frequent queries. An empty path keeps counts
+    in memory only.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._pending: Counter[str] = Counter()
+
+    def record(self, query: str) -> None:
+        with self._lock:
+            self._pending[query] += 1
+
+    def _read(self) -> Counter[str]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return Counter(json.load(f))
+        except (OSError, ValueError):
+            return Counter()
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending or not self.path:
+            return
+        with open(self.path + ".lock", "w") as lock:
+            if fcntl is not None:  # without fork() (Windows) one process owns the file
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            counts = self._read()
+            counts.update(pending)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(dict(counts.most_common(self.max_entries)), f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+
+    def top(self, n: int) -> list[str]:
+        """The n most frequent queries, from the file plus counts not yet flushed."""
+        counts = self._read() if self.path else Counter()
+        with self._lock:
+            counts.update(self._pending)
+        return [query for query, _ in counts.most_common(n)]
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+
+
+TOKENS_FILE = "rerank_tokens.npy"
+OFFSETS_FILE = "rerank_offsets.npy"
+
+
+def write_rerank_tokens(texts, tokenizer, max_tokens: int, out_dir: str, batch_size: int = 1024) -> None:
+    """
+    Token ids of every doc text for the reranker's tokenizer, without special
+    tokens and truncated to max_tokens, as one flat array plus offsets (doc i
+    is tokens[offsets[i]:offsets[i + 1]]).
+    """
+    chunks = []
+    for start in range(0, len(texts), batch_size):
+        batch = [texts[i] for i in range(start, min(start + batch_size, len(texts)))]
+        chunks += tokenizer(batch, add_special_tokens=False, truncation=True, max_length=max_tokens)["input_ids"]
+    offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in chunks], out=offsets[1:])
+    dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max else np.int32
+    tokens = np.fromiter((t for c in chunks for t in c), dtype=dtype, count=int(offsets[-1]))
+    np.save(os.path.join(out_dir, TOKENS_FILE), tokens)
+    np.save(os.path.join(out_dir, OFFSETS_FILE), offsets)
+
+
+def load_rerank_tokens(index_dir: str) -> tuple[np.ndarray, np.ndarray] | None:
+    """(tokens, offsets), memory-mapped, or None if not built."""
+    paths = [os.path.join(index_dir, name) for name in (TOKENS_FILE, OFFSETS_FILE)]
+    if not all(os.path.exists(p) for p in paths):
+        return None
+    return tuple(np.load(p, mmap_mode="r") for p in paths)
+
+
+def _find(ids: list[int], sub: list[int], start: int) -> int:
+    for i in range(start, len(ids) - len(sub) + 1):
+        if ids[i:i + len(sub)] == sub:
+            return i
+    raise ValueError("probe tokens not found in the encoded pair")
+
+
+class PairTemplate:
+    """
+    How a tokenizer lays out a (query, doc) pair: the special tokens before,
+    between and after the two segments and each part's token type. Found by
+    encoding a probe pair, so it works for any tokenizer.
+    """
+
+    def __init__(self, tokenizer):
+        a = tokenizer("a", add_special_tokens=False)["input_ids"]
+        b = tokenizer("b", add_special_tokens=False)["input_ids"]
+        enc = tokenizer("a", "b")
+        ids = list(enc["input_ids"])
+        types = list(enc.get("token_type_ids") or [0] * len(ids))
+        ia = _find(ids, a, 0)
+        ib = _find(ids, b, ia + len(a))
+        self.prefix, self.middle, self.suffix = ids[:ia], ids[ia + len(a):ib], ids[ib + len(b):]
+        self.types = (types[:ia], types[ia], types[ia + len(a):ib], types[ib], types[ib + len(b):])
+        self.special = len(self.prefix) + len(self.middle) + len(self.suffix)
+        self.pad_id = tokenizer.pad_token_id or 0
+
+    def _row(self, query: np.ndarray, doc: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        prefix_t, query_t, middle_t, doc_t, suffix_t = self.types
+        ids = np.concatenate([self.prefix, query, self.middle, doc, self.suffix])
+        types = np.concatenate([prefix_t, [query_t] * len(query), middle_t, [doc_t] * len(doc), suffix_t])
+        return ids, types
+
+    def batches(self, pairs: list[tuple[np.ndarray, np.ndarray]], max_length: int, batch_size: int):
+        """
+        Model inputs for (query ids, doc ids) pairs, bucketed by length: pairs
+        are sorted by length and cut into batches, each padded only to its
+        own longest pair. Docs are cut to fit max_length after the query
+        (which keeps at most half). Yields (pair positions, input_ids,
+        token_type_ids, attention_mask) as int64 arrays.
+        """
+        rows = []
+        for query, doc in pairs:
+            query = query[:max(1, (max_length - self.special) // 2)]
+            rows.append(self._row(query, doc[:max(0, max_length - self.special - len(query))]))
+        order = np.argsort([len(ids) for ids, _ in rows], kind="stable")
+        for start in range(0, len(order), batch_size):
+            positions = order[start:start + batch_size]
+            width = max(len(rows[i][0]) for i in positions)
+            input_ids = np.full((len(positions), width), self.pad_id, dtype=np.int64)
+            token_types = np.zeros((len(positions), width), dtype=np.int64)
+            mask = np.zeros((len(positions), width), dtype=np.int64)
+            for r, i in enumerate(positions):
+                ids, types = rows[i]
+                input_ids[r, :len(ids)] = ids
+                token_types[r, :len(ids)] = types
+                mask[r, :len(ids)] = 1
+            yield positions, input_ids, token_types, mask
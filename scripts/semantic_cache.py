@@ -0,0 +1,147 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Bounded LRU cache of (query embedding, context, answer) keyed by meaning:
+    a lookup hits when the cosine similarity between the query embedding and a
+    cached one reaches `threshold`. Embeddings must be L2-normalized. Entries
+    belong to the index version installed with set_version(), which drops them
+    all; get/put for any other version (a request still holding an older
+    snapshot) miss or are ignored, so they never evict the current entries.
+    """
+
+    def __init__(self, max_entries: int, threshold: float):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.version = None
+        self._lock = threading.Lock()
+        self._embeddings: np.ndarray | None = None  # (max_entries, dim), allocated on first put
+        self._entries: OrderedDict[int, tuple[str, str]] = OrderedDict()  # slot -> (context, answer), LRU first
+        self._free = list(range(max_entries))
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def set_version(self, version) -> None:
+        """Install the current index version, dropping entries cached under another one."""
+        with self._lock:
+            if version == self.version:
+                return
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._free = list(range(self.max_entries))
+            self.version = version
+
+    def get(self, embedding: np.ndarray, version) -> tuple[str, str, float] | None:
+        """(context, answer, similarity) of the most similar entry within threshold, else None."""
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            if version != self.version or not self._entries:
+                self.misses += 1
+                return None
+            slots = np.fromiter(self._entries, dtype=np.int64, count=len(self._entries))
+            sims = self._embeddings[slots] @ embedding
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                self.misses += 1
+                return None
+            slot = int(slots[best])
+            self._entries.move_to_end(slot)
+            self.hits += 1
+            context, answer = self._entries[slot]
+            return context, answer, float(sims[best])
+
+    def put(self, embedding: np.ndarray, context: str, answer: str, version) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            if self._embeddings is None or self._embeddings.shape[1] != embedding.shape[0]:
+                self._embeddings = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+                self._entries.clear()
+                self._free = list(range(self.max_entries))
+            if not self._free:
+                slot, _ = self._entries.popitem(last=False)
+                self._free.append(slot)
+                self.evictions += 1
+            slot = self._free.pop()
+            self._embeddings[slot] = embedding
+            self._entries[slot] = (context, answer)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._free = list(range(self.max_entries))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "version": self.version,
+        }
+
+
+class LRUCache:
+    """Bounded, thread-safe exact-key LRU cache with hit/miss counters. max_entries <= 0 disables it."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key):
+        """The cached value, or None."""
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        if self.max_entries <= 0 or value is None:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,151 @@
+import argparse
+import os
+import sqlite3
+import time
+
+try:
+    from .triple_store import _split_nt_line
+except ImportError:  # run as a script
+    from triple_store import _split_nt_line
+
+
+SCHEMA = """
+CREATE TABLE terms (id INTEGER PRIMARY KEY, term TEXT NOT NULL UNIQUE);
+CREATE TABLE triples (
+    s INTEGER NOT NULL,
+    p INTEGER NOT NULL,
+    o INTEGER NOT NULL,
+    PRIMARY KEY (s, p, o)
+) WITHOUT ROWID;
+CREATE INDEX idx_pos ON triples (p, o, s);
+CREATE INDEX idx_osp ON triples (o, s, p);
+"""
+
+
+def build_sqlite(nt_path: str, db_path: str) -> int:
+    """
+    Load an N-Triples file into a SQLite database: a term dictionary plus a
+    triples table with covering indexes on (s,p,o), (p,o,s) and (o,s,p).
+    The database is built next to db_path and renamed into place.
+    """
+    start = time.time()
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript(SCHEMA)
+
+    ids: dict[str, int] = {}
+    rows = set()
+    with open(nt_path, "r", encoding="utf-8") as f:
+        for line in f:
+            t = _split_nt_line(line)
+            if not t:
+                continue
+            rows.add(tuple(ids.setdefault(term, len(ids)) for term in t))
+
+    conn.executemany("INSERT INTO terms (id, term) VALUES (?, ?)", ((i, term) for term, i in ids.items()))
+    conn.executemany("INSERT INTO triples (s, p, o) VALUES (?, ?, ?)", sorted(rows))
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    os.replace(tmp_path, db_path)
+
+    print(f"Loaded {len(rows):,} triples / {len(ids):,} terms into {db_path} in {time.time() - start:.2f}s")
+    return len(rows)
+
+
+class SQLiteStore:
+    """
+    Read-only query layer over a database written by build_sqlite, with the
+    same triples()/query() interface as TripleStore. The file is opened
+    read-only and memory-mapped, so several processes share it through the
+    OS page cache. Each process opens its own connection on first use: SQLite
+    connections must not be carried across fork().
+    """
+
+    def __init__(self, db_path: str, mmap_size: int = 1 << 30):
+        self.db_path = db_path
+        self.mmap_size = mmap_size
+        # pid -> connection. A forked child keeps (and never touches or closes) its parent's entry.
+        self._conns: dict[int, sqlite3.Connection] = {}
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        pid = os.getpid()
+        conn = self._conns.get(pid)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+            conn = self._conns.setdefault(pid, conn)  # a racing thread's connection wins; ours is dropped
+        return conn
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM triples").fetchone()[0]
+
+    def triples(self, s: str | None = None, p: str | None = None, o: str | None = None):
+        """Triple-pattern lookup over N-Triples terms; None is a wildcard."""
+        rows = self.query([(s or "?s", p or "?p", o or "?o")])
+        for row in rows:
+            yield row.get("?s", s), row.get("?p", p), row.get("?o", o)
+
+    def query(self, patterns: list[tuple[str, str, str]], limit: int | None = None) -> list[dict[str, str]]:
+        """
+        Evaluate a basic graph pattern as one SQL self-join. Positions starting
+        with "?" are variables; everything else is an N-Triples term.
+        """
+        constants = {t for pattern in patterns for t in pattern if not t.startswith("?")}
+        term_ids = {}
+        if constants:
+            marks = ",".join("?" * len(constants))
+            term_ids = dict(self.conn.execute(f"SELECT term, id FROM terms WHERE term IN ({marks})", list(constants)))
+            if len(term_ids) < len(constants):
+                return []
+
+        where, params = [], []
+        var_cols: dict[str, str] = {}
+        for i, pattern in enumerate(patterns):
+            for col, term in zip("spo", pattern):
+                ref = f"t{i}.{col}"
+                if not term.startswith("?"):
+                    where.append(f"{ref} = ?")
+                    params.append(term_ids[term])
+                elif term in var_cols:
+                    where.append(f"{ref} = {var_cols[term]}")
+                else:
+                    var_cols[term] = ref
+
+        variables = list(var_cols)
+        select = ", ".join(f"v{j}.term" for j in range(len(variables))) or "1"
+        tables = [f"triples t{i}" for i in range(len(patterns))]
+        tables += [f"terms v{j}" for j in range(len(variables))]
+        where += [f"v{j}.id = {var_cols[var]}" for j, var in enumerate(variables)]
+
+        sql = f"SELECT {select} FROM {', '.join(tables)}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return [dict(zip(variables, row)) for row in self.conn.execute(sql, params)]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load N-Triples into a SQLite triple store.")
+    parser.add_argument(
+        "--graph",
+        default="rdf/elden_ring_fast_linked.nt",
+        help="N-Triples input. Default: rdf/elden_ring_fast_linked.nt",
+    )
+    parser.add_argument(
+        "--out",
+        default="rdf/elden_ring.sqlite",
+        help="Output database. Default: rdf/elden_ring.sqlite",
+    )
+    args = parser.parse_args()
+    build_sqlite(args.graph, args.out)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,104 @@
+import hashlib
+import re
+import time
+
+import numpy as np
+import torch
+
+
+# Retriever id that build_rag_index.py and web_server.py map to StubBiEncoder.
+STUB_RETRIEVER_ID = "stub"
+STUB_DIM = 384
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _tokens(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _bucket(token: str, dim: int) -> tuple[int, float]:
+    digest = hashlib.md5(token.encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "little") % dim, 1.0 if digest[4] & 1 else -1.0
+
+
+def _sleep_ms(ms: float) -> None:
+    if ms > 0:
+        time.sleep(ms / 1000)
+
+
+class StubBiEncoder:
+    """
+    Deterministic stand-in for a SentenceTransformer: hashed bag-of-words
+    vectors, so texts sharing words are close. Each encode() call sleeps
+    latency_ms plus per_item_ms per text.
+    """
+
+    def __init__(self, dim: int = STUB_DIM, latency_ms: float = 0.0, per_item_ms: float = 0.0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.per_item_ms = per_item_ms
+
+    def encode(self, texts, convert_to_tensor=False, normalize_embeddings=False, batch_size=32, **kwargs):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        _sleep_ms(self.latency_ms + self.per_item_ms * len(texts))
+
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in zip(out, texts):
+            for token in _tokens(text):
+                i, sign = _bucket(token, self.dim)
+                row[i] += sign
+        if normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        result = torch.from_numpy(out) if convert_to_tensor else out
+        return result[0] if single else result
+
+
+class StubCrossEncoder:
+    """Deterministic stand-in for a CrossEncoder: score = shared query/doc words - 2. Sleeps per_pair_ms per pair."""
+
+    def __init__(self, latency_ms: float = 0.0, per_pair_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.per_pair_ms = per_pair_ms
+
+    def predict(self, pairs, batch_size=32, **kwargs):
+        _sleep_ms(self.latency_ms + self.per_pair_ms * len(pairs))
+        return np.array(
+            [len(set(_tokens(q)) & set(_tokens(d))) - 2.0 for q, d in pairs],
+            dtype=np.float32,
+        )
+
+
+class StubTokenizer:
+    """Just enough of a chat tokenizer for generate_answer."""
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        text = "".join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages)
+        return text + ("<|im_start|>assistant\n" if add_generation_prompt else "")
+
+
+class StubGenerator:
+    """
+    Stand-in for the text-generation pipeline: echoes the first context line
+    after sleeping latency_ms. Output has the pipeline's shape (prompt included).
+    A `streamer` gets the answer word by word through on_finalized_text, as
+    transformers' TextStreamer subclasses do, with the latency spread across words.
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+
+    def __call__(self, prompt: str, streamer=None, **kwargs):
+        context = prompt.split("Data Context:\n", 1)[-1]
+        answer = "From the archives: " + context.split("\n", 1)[0]
+        if streamer is None:
+            _sleep_ms(self.latency_ms)
+        else:
+            words = answer.split(" ")
+            for i, word in enumerate(words):
+                _sleep_ms(self.latency_ms / len(words))
+                streamer.on_finalized_text(word if i == len(words) - 1 else word + " ")
+            streamer.on_finalized_text("", stream_end=True)
+        return [{"generated_text": prompt + answer}]
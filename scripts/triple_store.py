@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+
+# Column order of each sorted index, as positions into (s, p, o).
+INDEXES = {
+    "spo": (0, 1, 2),
+    "pos": (1, 2, 0),
+    "osp": (2, 0, 1),
+}
+_INVERSE = {name: np.argsort(cols) for name, cols in INDEXES.items()}
+
+_ESCAPES = {"n": "\n", "r": "\r", "t": "\t", "b": "\b", "f": "\f"}
+_ESCAPE_RE = re.compile(r"\\(?:U([0-9A-Fa-f]{8})|u([0-9A-Fa-f]{4})|(.))")
+
+
+def _split_nt_line(line: str) -> tuple[str, str, str] | None:
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    s, rest = line.split(" ", 1)
+    p, rest = rest.split(" ", 1)
+    o = rest.rstrip()[:-1].rstrip()  # drop the trailing " ."
+    return s, p, o
+
+
+def _unescape(m: re.Match) -> str:
+    code = m.group(1) or m.group(2)
+    if code:
+        return chr(int(code, 16))
+    return _ESCAPES.get(m.group(3), m.group(3))
+
+
+def nt_value(term: str) -> str:
+    """Plain value of an N-Triples term: the URI of <...>, or the unescaped lexical form of a literal."""
+    if term.startswith("<"):
+        return term[1:-1]
+    if term.startswith('"'):
+        return _ESCAPE_RE.sub(_unescape, term[1:term.rindex('"')])
+    return term
+
+
+def build_store(nt_path: str, out_dir: str) -> dict:
+    """
+    Compile an N-Triples file into a dictionary-encoded store:
+      terms.bin / term_offsets.npy  sorted UTF-8 terms, id = position
+      spo.npy / pos.npy / osp.npy   int32 (n, 3) id arrays, each sorted on its column order
+    """
+    start = time.time()
+    triples = set()
+    with open(nt_path, "r", encoding="utf-8") as f:
+        for line in f:
+            t = _split_nt_line(line)
+            if t:
+                triples.add(t)
+
+    terms = sorted({term.encode("utf-8") for t in triples for term in t})
+    ids = {term.decode("utf-8"): i for i, term in enumerate(terms)}
+    encoded = np.array([[ids[s], ids[p], ids[o]] for s, p, o in triples], dtype=np.int32).reshape(-1, 3)
+
+    os.makedirs(out_dir, exist_ok=True)
+    staging = out_dir.rstrip("/\\") + ".staging"
+    os.makedirs(staging, exist_ok=True)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in terms], out=offsets[1:])
+    with open(os.path.join(staging, "terms.bin"), "wb") as f:
+        f.write(b"".join(terms))
+    np.save(os.path.join(staging, "term_offsets.npy"), offsets)
+
+    for name, cols in INDEXES.items():
+        permuted = encoded[:, cols]
+        order = np.lexsort((permuted[:, 2], permuted[:, 1], permuted[:, 0]))
+        np.save(os.path.join(staging, f"{name}.npy"), np.ascontiguousarray(permuted[order]))
+
+    st = os.stat(nt_path)
+    meta = {
+        "created_at": int(time.time()),
+        "source": {"path": nt_path.replace("\\", "/"), "mtime": int(st.st_mtime), "size": int(st.st_size)},
+        "triple_count": int(len(encoded)),
+        "term_count": int(len(terms)),
+    }
+    with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    # Move files into place with meta.json last; new inodes leave a running server's mapped files intact.
+    for name in sorted(os.listdir(staging), key=lambda n: n == "meta.json"):
+        os.replace(os.path.join(staging, name), os.path.join(out_dir, name))
+    os.rmdir(staging)
+
+    print(f"Compiled {len(encoded):,} triples / {len(terms):,} terms into {out_dir} in {time.time() - start:.2f}s")
+    return meta
+
+
+class TripleStore:
+    """
+    Read-only, memory-mapped view of a store written by build_store.
+    Terms are N-Triples strings (e.g. "<http://...>" or "\"5\"^^<...#integer>").
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta["term_count"]:
+            self._terms = np.memmap(os.path.join(store_dir, "terms.bin"), dtype=np.uint8, mode="r")
+        else:
+            self._terms = np.zeros(0, dtype=np.uint8)  # np.memmap cannot map an empty file
+        self._offsets = np.load(os.path.join(store_dir, "term_offsets.npy"), mmap_mode="r")
+        self._index = {name: np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode="r") for name in INDEXES}
+
+    def __len__(self) -> int:
+        return int(self.meta["triple_count"])
+
+    def _term_bytes(self, term_id: int) -> bytes:
+        return self._terms[self._offsets[term_id]:self._offsets[term_id + 1]].tobytes()
+
+    def term(self, term_id: int) -> str:
+        return self._term_bytes(int(term_id)).decode("utf-8")
+
+    def term_id(self, term: str) -> int | None:
+        """Binary search the sorted term dictionary."""
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self._offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._offsets) - 1 and self._term_bytes(lo) == key:
+            return lo
+        return None
+
+    def ids(self, s: int | None = None, p: int | None = None, o: int | None = None) -> np.ndarray:
+        """Matching triples as an (k, 3) id array in (s, p, o) column order."""
+        bound = (s, p, o)
+        if s is not None:
+            name = "osp" if (o is not None and p is None) else "spo"
+        elif p is not None:
+            name = "pos"
+        elif o is not None:
+            name = "osp"
+        else:
+            name = "spo"
+
+        cols = INDEXES[name]
+        rows = self._index[name]
+        lo, hi = 0, len(rows)
+        covered = 0
+        for depth, col in enumerate(cols):
+            value = bound[col]
+            if value is None:
+                break
+            column = rows[lo:hi, depth]
+            start = int(np.searchsorted(column, value, side="left"))
+            end = int(np.searchsorted(column, value, side="right"))
+            lo, hi = lo + start, lo + end
+            covered += 1
+            if lo == hi:
+                break
+
+        # Undo the column permutation and apply any bound position the prefix did not cover.
+        spo = np.asarray(rows[lo:hi])[:, _INVERSE[name]]
+        for col in cols[covered:]:
+            if bound[col] is not None:
+                spo = spo[spo[:, col] == bound[col]]
+        return spo
+
+    def triples(self, s: str | None = None, p: str | None = None, o: str | None = None):
+        """Triple-pattern lookup over N-Triples terms; None is a wildcard."""
+        bound = []
+        for term in (s, p, o):
+            if term is None:
+                bound.append(None)
+                continue
+            term_id = self.term_id(term)
+            if term_id is None:
+                return
+            bound.append(term_id)
+        for row in self.ids(*bound):
+            yield self.term(row[0]), self.term(row[1]), self.term(row[2])
+
+    def query(self, patterns: list[tuple[str, str, str]], limit: int | None = None) -> list[dict[str, str]]:
+        """
+        Evaluate a basic graph pattern. Positions starting with "?" are
+        variables; everything else is an N-Triples term. Returns one
+        {variable: term} dict per solution.
+        """
+        encoded = []
+        for pattern in patterns:
+            row = []
+            for term in pattern:
+                if term.startswith("?"):
+                    row.append(term)
+                else:
+                    term_id = self.term_id(term)
+                    if term_id is None:
+                        return []
+                    row.append(term_id)
+            encoded.append(row)
+
+        solutions: list[dict[str, int]] = [{}]
+        remaining = list(encoded)
+        while remaining and solutions:
+            # Join the most selective pattern next: most positions bound by constants or prior variables.
+            bound_vars = set(solutions[0])
+            remaining.sort(key=lambda pat: -sum(1 for t in pat if not isinstance(t, str) or t in bound_vars))
+            pattern = remaining.pop(0)
+
+            joined: list[dict[str, int]] = []
+            for solution in solutions:
+                bound = [solution.get(t) if isinstance(t, str) else t for t in pattern]
+                for row in self.ids(*bound):
+                    extended = dict(solution)
+                    ok = True
+                    for t, value in zip(pattern, row):
+                        if isinstance(t, str):
+                            if extended.setdefault(t, int(value)) != value:
+                                ok = False
+                                break
+                    if ok:
+                        joined.append(extended)
+            solutions = joined
+
+        if limit is not None:
+            solutions = solutions[:limit]
+        return [{var: self.term(term_id) for var, term_id in s.items()} for s in solutions]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compile N-Triples into a memory-mappable triple store.")
+    parser.add_argument(
+        "--graph",
+        default="rdf/elden_ring_fast_linked.nt",
+        help="N-Triples input. Default: rdf/elden_ring_fast_linked.nt",
+    )
+    parser.add_argument(
+        "--out",
+        default="rdf/elden_ring_store",
+        help="Output directory. Default: rdf/elden_ring_store",
+    )
+    args = parser.parse_args()
+    build_store(args.graph, args.out)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
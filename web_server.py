@@ -1,57 +1,233 @@
 import uvicorn
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
-from pydantic import BaseModel
+from fastapi.responses import HTMLResponse, StreamingResponse
+from pydantic import BaseModel, Field
+import asyncio
+import gc
+from collections import deque
 import os
 import json
+import socket
+import threading
 import time
+import warnings
+import numpy as np
 import torch
 from rdflib import Graph
-from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM
+from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM, TextStreamer
 from sentence_transformers import SentenceTransformer, CrossEncoder, util
+from scripts.admission import QueueFull, StageQueue
+from scripts.coalesce import Broadcast, SingleFlight, normalize_query
+from scripts.doc_store import DocStore
+from scripts.graph_rank import personalized_pagerank, seed_matrix, transition_matrix
+from scripts.pca import load_pca, search as pca_search
+from scripts.profiling import profile_call
+from scripts.query_log import QueryLog
+from scripts.rerank_tokens import PairTemplate, load_rerank_tokens
+from scripts.semantic_cache import LRUCache, SemanticCache
+from scripts.stub_models import StubBiEncoder, StubCrossEncoder, StubGenerator, StubTokenizer
+from scripts.sqlite_store import SQLiteStore
+from scripts.triple_store import TripleStore, nt_value
 
 app = FastAPI(title="EldenRAG Final", description="Precision Reranking")
 
 # --- CONFIG ---
-GRAPH_FILE = "rdf/elden_ring_linked.ttl"
+GRAPH_FILE = "rdf/elden_ring_fast_linked.nt"
+# Checked-in graph, read when GRAPH_FILE has not been generated (scripts/linker.py, scripts/optimize.py)
+GRAPH_FILE_TTL = "rdf/elden_ring_linked.ttl"
+STORE_DIR = "rdf/elden_ring_store"  # built by scripts/optimize.py; used instead of GRAPH_FILE when present
+SQLITE_PATH = "rdf/elden_ring.sqlite"  # built by scripts/sqlite_store.py
+# Graph backend for structured_retrieve: "auto" (store if built, else rdflib), "store", "sqlite" or "rdflib"
+GRAPH_BACKEND = os.environ.get("ELDENRAG_GRAPH_BACKEND", "auto")
 INDEX_DIR = "rag_index"
-DOCS_PATH = os.path.join(INDEX_DIR, "docs.json")
-EMB_PATH = os.path.join(INDEX_DIR, "embeddings.pt")
+EMB_NPY_PATH = os.path.join(INDEX_DIR, "embeddings.npy")
 META_PATH = os.path.join(INDEX_DIR, "meta.json")
+CLUSTERS_PATH = os.path.join(INDEX_DIR, "clusters.json")
+# CSR neighbour graph written by build_rag_index.py (indptr, indices, predicate codes)
+ADJACENCY_PATHS = tuple(os.path.join(INDEX_DIR, name) for name in ("adj_indptr.npy", "adj_indices.npy", "adj_predicates.npy"))
 
 RETRIEVER_ID = "BAAI/bge-base-en-v1.5"
 RERANKER_ID = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 LLM_ID = "Qwen/Qwen2.5-7B-Instruct-GGUF" # Placeholder for GGUF path or model ID if using transformers
 
+# Assisted generation: a small draft model sharing Qwen's tokenizer proposes DRAFT_TOKENS
+# tokens per step and the main model verifies them. Empty disables it. Measure with scripts/bench_generation.py.
+DRAFT_MODEL_ID = os.environ.get("ELDENRAG_DRAFT_MODEL", "")  # e.g. Qwen/Qwen2.5-0.5B-Instruct
+DRAFT_TOKENS = int(os.environ.get("ELDENRAG_DRAFT_TOKENS", "5"))
+
+# Never load the LLM; serve retrieval only (/api/retrieve, or context without a generated answer).
+RETRIEVAL_ONLY = os.environ.get("ELDENRAG_RETRIEVAL_ONLY", "0").lower() in ("1", "true", "yes")
+
+ENCODE_BATCH_SIZE = 64   # bi-encoder queries per forward pass
+RERANK_BATCH_SIZE = 128  # cross-encoder (query, doc) pairs per forward pass
+MAX_BATCH_QUERIES = 512  # /api/batch request limit
+
+# First-stage search on PCA-reduced vectors of this width (built with build_rag_index.py --pca-dims);
+# SEARCH_POOL x top_k candidates are rescored with the full vectors. 0 searches at full width.
+SEARCH_DIMS = int(os.environ.get("ELDENRAG_SEARCH_DIMS", "0"))
+SEARCH_POOL = int(os.environ.get("ELDENRAG_SEARCH_POOL", "4"))
+
+# Graph neighbours (drops, locatedAt, ...) of the selected docs added to each context; 0 disables.
+NEIGHBOUR_BUDGET = int(os.environ.get("ELDENRAG_NEIGHBOUR_BUDGET", "3"))
+# Upper bound on a request's own "neighbours" budget, so a client cannot fill the LLM prompt with the graph.
+MAX_NEIGHBOUR_BUDGET = int(os.environ.get("ELDENRAG_MAX_NEIGHBOUR_BUDGET", "10"))
+
+# Graph boost: personalized PageRank over the neighbour graph, seeded by each query's PPR_SEEDS best
+# bi-encoder hits (PPR_ITERATIONS steps, restart probability PPR_RESTART). Candidates are re-ordered
+# by bi-encoder score + PPR_WEIGHT x propagated mass (scaled to 1 per query) before reranking, after
+# the PPR_EXPAND best-connected docs outside the candidates join the pool. 0 weight disables it.
+PPR_WEIGHT = float(os.environ.get("ELDENRAG_PPR_WEIGHT", "0"))
+PPR_ITERATIONS = int(os.environ.get("ELDENRAG_PPR_ITERATIONS", "5"))
+PPR_RESTART = float(os.environ.get("ELDENRAG_PPR_RESTART", "0.3"))
+PPR_SEEDS = int(os.environ.get("ELDENRAG_PPR_SEEDS", "10"))
+PPR_EXPAND = int(os.environ.get("ELDENRAG_PPR_EXPAND", "10"))
+
+# Semantic answer cache for the retrieval path: a query whose embedding is within
+# CACHE_THRESHOLD cosine of a cached one reuses its context and answer. 0 entries disables it.
+CACHE_SIZE = int(os.environ.get("ELDENRAG_CACHE_SIZE", "1024"))
+CACHE_THRESHOLD = float(os.environ.get("ELDENRAG_CACHE_THRESHOLD", "0.95"))
+
+# Exact-match caches in front of the bi-encoder (normalized query -> embedding) and of retrieval
+# and reranking (normalized query, neighbour budget, index version -> context).
+EMBED_CACHE_SIZE = int(os.environ.get("ELDENRAG_EMBED_CACHE_SIZE", "4096"))
+CONTEXT_CACHE_SIZE = int(os.environ.get("ELDENRAG_CONTEXT_CACHE_SIZE", "1024"))
+
+# Query log: normalized query -> hit count, flushed every QUERY_LOG_FLUSH seconds ("" keeps it in memory).
+# On startup and after each reload the WARM_TOP most frequent queries are replayed through retrieval
+# (and generation with WARM_GENERATE) to fill the caches: one at a time, only while the stage queues
+# are idle and WARM_INTERVAL_MS apart, so live traffic always goes first.
+QUERY_LOG_PATH = os.environ.get("ELDENRAG_QUERY_LOG", "query_log.json")
+QUERY_LOG_MAX = int(os.environ.get("ELDENRAG_QUERY_LOG_MAX", "10000"))
+QUERY_LOG_FLUSH = float(os.environ.get("ELDENRAG_QUERY_LOG_FLUSH", "30"))
+WARM_TOP = int(os.environ.get("ELDENRAG_WARM_TOP", "200"))
+WARM_GENERATE = os.environ.get("ELDENRAG_WARM_GENERATE", "0").lower() in ("1", "true", "yes")
+WARM_INTERVAL_MS = float(os.environ.get("ELDENRAG_WARM_INTERVAL_MS", "20"))
+
+# Poll rag_index/meta.json and the graph snapshot every this many seconds and hot-swap
+# a rebuilt index in the background; 0 disables watching (POST /api/admin/reload still works).
+RELOAD_INTERVAL = float(os.environ.get("ELDENRAG_RELOAD_INTERVAL", "5"))
+# When set, /api/admin/* requires this value in the X-Admin-Token header.
+ADMIN_TOKEN = os.environ.get("ELDENRAG_ADMIN_TOKEN", "")
+
+# Per-request profiling (X-Profile: 1 header or ?profile=1 on /api/chat): .prof files are kept
+# in a ring of the PROFILE_KEEP most recent under PROFILE_DIR.
+PROFILE_DIR = os.environ.get("ELDENRAG_PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.environ.get("ELDENRAG_PROFILE_KEEP", "20"))
+# Stage name -> function whose cumulative time is reported for it.
+PROFILE_STAGES = {
+    "structured": "structured_retrieve",
+    "encode": "encode_queries",
+    "search": "_semantic_search",
+    "graph_boost": "_graph_boost",
+    "stat_filter": "_dual_stat_filter",
+    "rerank": "_cross_scores",
+    "select": "_select_hits",
+    "neighbours": "_neighbour_hits",
+    "generate": "generate_answer",
+}
+
+# Load-test configuration: deterministic stub encoder, reranker and LLM (scripts/stub_models.py)
+# with these simulated latencies instead of real models. Pair with an index built with --retriever stub.
+STUB_MODELS = os.environ.get("ELDENRAG_STUB_MODELS", "0").lower() in ("1", "true", "yes")
+STUB_ENCODE_MS = float(os.environ.get("ELDENRAG_STUB_ENCODE_MS", "5"))
+STUB_RERANK_MS = float(os.environ.get("ELDENRAG_STUB_RERANK_MS", "0.2"))  # per (query, doc) pair
+STUB_GENERATE_MS = float(os.environ.get("ELDENRAG_STUB_GENERATE_MS", "500"))
+
+# Admission control: retrieval (encode/search/rerank) and generation each run on their own worker
+# threads behind a bounded queue; a full queue answers 503 with Retry-After instead of queueing.
+# Structured (KG) answers and cache lookups take a fast lane with its own bound that is always
+# served first, so they never wait behind a backlog of generations.
+RERANK_WORKERS = int(os.environ.get("ELDENRAG_RERANK_WORKERS", "1"))
+RERANK_QUEUE = int(os.environ.get("ELDENRAG_RERANK_QUEUE", "32"))
+LLM_QUEUE = int(os.environ.get("ELDENRAG_LLM_QUEUE", "8"))
+FAST_QUEUE = int(os.environ.get("ELDENRAG_FAST_QUEUE", "64"))
+
+# Event-loop lag is sampled this often and reported by /api/metrics.
+LAG_INTERVAL_MS = float(os.environ.get("ELDENRAG_LAG_INTERVAL_MS", "50"))
+
+PORT = int(os.environ.get("ELDENRAG_PORT", "8000"))
+
+# >1 forks that many workers from this (fully loaded) process; see _serve_prefork.
+WORKERS = int(os.environ.get("ELDENRAG_WORKERS", "1"))
+
 templates = Jinja2Templates(directory="templates")
 
 class QueryModel(BaseModel):
     query: str
+    neighbours: int | None = Field(default=None, ge=0, le=MAX_NEIGHBOUR_BUDGET)  # per-request override of NEIGHBOUR_BUDGET
+
+
+class BatchQueryModel(BaseModel):
+    queries: list[str]
+    generate: bool = False
+    neighbours: int | None = Field(default=None, ge=0, le=MAX_NEIGHBOUR_BUDGET)
 
 
 def _device() -> str:
     return "cuda" if torch.cuda.is_available() else "cpu"
 
 
+def _memory_report() -> str:
+    """RSS and PSS of this process (Linux). PSS splits shared pages between the processes mapping them."""
+    fields = {}
+    try:
+        for path in ("/proc/self/status", "/proc/self/smaps_rollup"):
+            with open(path, "r") as f:
+                for line in f:
+                    key, _, value = line.partition(":")
+                    if key in ("VmRSS", "RssAnon", "RssFile", "Pss") and value.strip().endswith("kB"):
+                        fields[key] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    if not fields:
+        return "memory report unavailable on this platform"
+    return ", ".join(f"{k}={v:,.0f}MB" for k, v in fields.items())
+
+
+def _load_index_meta() -> dict:
+    if not os.path.exists(META_PATH):
+        return {}
+    with open(META_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _index_version(meta: dict) -> str:
+    """Identifies one build of the index; cached answers from another build are discarded."""
+    return f"{meta.get('created_at', 0)}:{meta.get('retriever_id', '')}:{meta.get('doc_count', 0)}"
+
+
+def _load_clusters() -> dict[str, list[dict]]:
+    """Representative subject -> near-duplicate members collapsed out of the index."""
+    if not os.path.exists(CLUSTERS_PATH):
+        return {}
+    with open(CLUSTERS_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _load_adjacency() -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+    if not all(os.path.exists(p) for p in ADJACENCY_PATHS):
+        return None
+    return tuple(np.load(p, mmap_mode="r") for p in ADJACENCY_PATHS)
+
+
 def _load_index():
-    if not (os.path.exists(DOCS_PATH) and os.path.exists(EMB_PATH)):
+    """(doc store, embeddings); both memory-mapped, docs decoded per field on access."""
+    if not (DocStore.exists(INDEX_DIR) and os.path.exists(EMB_NPY_PATH)):
         raise FileNotFoundError(
-            f"Missing RAG index. Build it first with: "
-            f"python scripts/build_rag_index.py --graph {GRAPH_FILE} --out {INDEX_DIR}"
+            f"Missing RAG index (or one built before the doc store). Build it with: "
+            f"python scripts/build_rag_index.py --graph {_graph_file()} --out {INDEX_DIR}"
         )
+    # Memory-mapped and read-only, so every worker shares the same pages in the OS page cache.
+    store = DocStore(INDEX_DIR)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)  # torch warns that the mapping is not writable
+        embeddings = torch.from_numpy(np.load(EMB_NPY_PATH, mmap_mode="r"))
+    return store, embeddings
 
-    with open(DOCS_PATH, "r", encoding="utf-8") as f:
-        docs = json.load(f)
-
-    embeddings = torch.load(EMB_PATH, map_location="cpu")
-    if not torch.is_tensor(embeddings):
-        embeddings = torch.tensor(embeddings)
 
-    # Map doc index -> subject URI for traceability
-    doc_subjects = [d.get("subject", "") for d in docs]
-    doc_texts = [d.get("text", "") for d in docs]
-    return docs, doc_texts, doc_subjects, embeddings
+def _graph_file() -> str:
+    return GRAPH_FILE if os.path.exists(GRAPH_FILE) or not os.path.exists(GRAPH_FILE_TTL) else GRAPH_FILE_TTL
 
 
 def _load_rdf_graph(graph_path: str) -> Graph:
@@ -59,31 +235,185 @@ def _load_rdf_graph(graph_path: str) -> Graph:
         raise FileNotFoundError(f"RDF graph not found: {graph_path}")
     g = Graph()
     start = time.time()
-    # Use 'turtle' format for .ttl files
-    g.parse(graph_path, format="turtle")
+    # N-Triples from the converter/linker pipeline; 'turtle' for legacy .ttl files
+    fmt = "nt" if graph_path.endswith(".nt") else "turtle"
+    g.parse(graph_path, format=fmt)
     print(f"Loaded RDF graph ({len(g):,} triples) from {graph_path} in {time.time() - start:.2f}s")
     return g
 
 
+def _open_graph_backend(backend: str):
+    """Return (triple_store, rdf_graph); exactly one is set."""
+    if backend == "sqlite":
+        if not os.path.exists(SQLITE_PATH):
+            raise FileNotFoundError(f"SQLite store not found: {SQLITE_PATH}. Build it with: python scripts/sqlite_store.py")
+        store = SQLiteStore(SQLITE_PATH)
+        print(f"Opened SQLite store ({len(store):,} triples) from {SQLITE_PATH}")
+        return store, None
+    if backend in ("auto", "store") and os.path.exists(os.path.join(STORE_DIR, "meta.json")):
+        store = TripleStore(STORE_DIR)
+        print(f"Opened triple store ({len(store):,} triples) from {STORE_DIR}")
+        return store, None
+    if backend == "store":
+        raise FileNotFoundError(f"Triple store not found: {STORE_DIR}. Build it with: python scripts/optimize.py")
+    return None, _load_rdf_graph(_graph_file())
+
+
+def _graph_source(backend: str) -> str:
+    """File whose replacement means the graph backend changed (see _open_graph_backend)."""
+    if backend == "sqlite":
+        return SQLITE_PATH
+    if backend == "store" or (backend == "auto" and os.path.exists(os.path.join(STORE_DIR, "meta.json"))):
+        return os.path.join(STORE_DIR, "meta.json")
+    return _graph_file()
+
+
+def _mtime(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _watch_stamp() -> tuple[int | None, int | None]:
+    """(index meta.json, graph snapshot) modification times; build scripts write these last."""
+    return _mtime(META_PATH), _mtime(_graph_source(GRAPH_BACKEND))
+
+
+class IndexSnapshot:
+    """
+    One loaded version of the RAG index and graph backend. Requests take the
+    current snapshot once and use it throughout, so a reload never changes
+    data under an in-flight request; an old snapshot is freed when the last
+    request holding it finishes.
+    """
+
+    def __init__(self):
+        # Stamp first: files replaced while we load are picked up by the next reload.
+        self.stamp = _watch_stamp()
+        self.docs, self.corpus_embeddings_cpu = _load_index()
+        # Lazy per-field views: only the hits that are reranked or returned get decoded.
+        self.doc_texts = self.docs.column("text")
+        self.doc_subjects = self.docs.column("subject")
+        self.doc_titles = self.docs.column("title")
+        self.meta = _load_index_meta()
+        # Chunked index: docs are bounded-length chunks whose "subject" is the parent entity.
+        self.chunked = self.meta.get("chunk_chars", 0) > 0
+        self.clusters = _load_clusters()
+        self.adjacency = _load_adjacency()
+        self.neighbour_predicates = (self.meta.get("adjacency") or {}).get("predicates", [])
+        self.walk = (
+            transition_matrix(*self.adjacency[:2], PPR_RESTART) if self.adjacency is not None and PPR_WEIGHT > 0 else None
+        )
+        # Side files are only used when meta.json lists them and they cover this build's doc list,
+        # so files left over from another build can never map hits to the wrong docs.
+        doc_count = self.meta.get("doc_count")
+        self.reduced = load_pca(INDEX_DIR, SEARCH_DIMS) if SEARCH_DIMS in self.meta.get("pca_dims", []) else None
+        if self.reduced is not None and self.reduced[0].shape[0] != doc_count:
+            self.reduced = None
+        # Doc token ids for the reranker, when the index was tokenized for the one we load.
+        tokenized_for = (self.meta.get("rerank_tokens") or {}).get("reranker_id")
+        self.rerank_tokens = load_rerank_tokens(INDEX_DIR) if tokenized_for == RERANKER_ID and not STUB_MODELS else None
+        if self.rerank_tokens is not None and len(self.rerank_tokens[1]) != doc_count + 1:
+            self.rerank_tokens = None
+        if SEARCH_DIMS and self.reduced is None:
+            print(f"No {SEARCH_DIMS}-dim PCA index in {INDEX_DIR}; searching at full width.")
+
+        # Load the graph once so certain questions can be answered exactly.
+        # The memory-mapped and SQLite stores open near-instantly and are shared between
+        # worker processes through the page cache; rdflib + SPARQL is the fallback.
+        self.triple_store, self.rdf_graph = _open_graph_backend(GRAPH_BACKEND)
+
+        self.corpus_embeddings = self.corpus_embeddings_cpu.to(_device())
+        # Keys the semantic answer cache: answers from another index or graph build are discarded.
+        self.version = f"{_index_version(self.meta)}|graph:{self.stamp[1]}"
+        self.loaded_at = time.time()
+
+
 # --- Load retrieval assets once (fast) ---
 print("⏳ Loading RAG index + models...")
 print(f"   Torch CUDA available: {torch.cuda.is_available()}")
 
-docs, doc_texts, doc_subjects, corpus_embeddings_cpu = _load_index()
+snapshot = IndexSnapshot()
+
+if STUB_MODELS:
+    print(f"Stub models: encode {STUB_ENCODE_MS}ms, rerank {STUB_RERANK_MS}ms/pair, generate {STUB_GENERATE_MS}ms")
+    bi_encoder = StubBiEncoder(dim=snapshot.corpus_embeddings.shape[1], latency_ms=STUB_ENCODE_MS)
+    cross_encoder = StubCrossEncoder(per_pair_ms=STUB_RERANK_MS)
+else:
+    print(f"Loading Bi-Encoder ({RETRIEVER_ID}) on {_device()}...")
+    # Use HuggingFaceEmbeddings wrapper if using LangChain, or SentenceTransformer directly
+    # BAAI/bge-base-en-v1.5 works with SentenceTransformer
+    bi_encoder = SentenceTransformer(RETRIEVER_ID, device=_device())
+
+    print(f"Loading Cross-Encoder ({RERANKER_ID}) on {_device()}...")
+    cross_encoder = CrossEncoder(RERANKER_ID, device=_device())
+
+# Lays out pre-tokenized (query, doc) pairs for the cross-encoder; None falls back to predict().
+pair_template = None
+pair_max_length = 512  # tokens per assembled pair, read from the cross-encoder once
+if not STUB_MODELS:
+    try:
+        pair_template = PairTemplate(cross_encoder.tokenizer)
+    except ValueError as e:
+        print(f"Pre-tokenized reranking disabled: {e}")
+    pair_max_length = cross_encoder.max_seq_length or min(cross_encoder.tokenizer.model_max_length, 512)
+
+print(
+    f"Index ready: {len(snapshot.doc_texts):,} docs, dim={snapshot.corpus_embeddings.shape[1]}"
+    + (f", first-stage dim={SEARCH_DIMS} (pool x{SEARCH_POOL})" if snapshot.reduced is not None else "")
+)
 
-# Load RDF graph once so certain questions can be answered exactly via SPARQL.
-rdf_graph = _load_rdf_graph(GRAPH_FILE)
+_reload_lock = threading.Lock()
+reload_status = {"reloads": 0, "reloading": False, "last_error": None}
 
-print(f"Loading Bi-Encoder ({RETRIEVER_ID}) on {_device()}...")
-# Use HuggingFaceEmbeddings wrapper if using LangChain, or SentenceTransformer directly
-# BAAI/bge-base-en-v1.5 works with SentenceTransformer
-bi_encoder = SentenceTransformer(RETRIEVER_ID, device=_device())
 
-print(f"Loading Cross-Encoder ({RERANKER_ID}) on {_device()}...")
-cross_encoder = CrossEncoder(RERANKER_ID, device=_device())
+def reload_index(reason: str) -> IndexSnapshot:
+    """
+    Load the index and graph again (models are kept) and swap the new
+    snapshot in with a single assignment. Raises, keeping the active
+    snapshot, if loading fails or the new index was built for a different
+    embedding space.
+    """
+    global snapshot
+    with _reload_lock:
+        reload_status["reloading"] = True
+        start = time.time()
+        print(f"Reloading index and graph ({reason})...")
+        try:
+            new = IndexSnapshot()
+            old_space = (snapshot.meta.get("retriever_id"), snapshot.corpus_embeddings.shape[1])
+            new_space = (new.meta.get("retriever_id"), new.corpus_embeddings.shape[1])
+            if new_space != old_space:
+                raise RuntimeError(f"index was built for {new_space}, but the server encodes queries for {old_space}")
+            snapshot = new
+        except Exception as e:
+            reload_status["last_error"] = f"{type(e).__name__}: {e}"
+            print(f"Reload failed, keeping version {snapshot.version}: {e}")
+            raise
+        finally:
+            reload_status["reloading"] = False
+        reload_status["reloads"] += 1
+        reload_status["last_error"] = None
+        context_cache.clear()  # keyed by version; the old entries can no longer hit
+        answer_cache.set_version(new.version)  # requests still on the old snapshot now miss instead of evicting
+        print(f"Swapped in version {new.version} ({len(new.doc_texts):,} docs) in {time.time() - start:.2f}s")
+        _schedule_warm(f"reload to {new.version}")
+        return new
 
-corpus_embeddings = corpus_embeddings_cpu.to(_device())
-print(f"Index ready: {len(doc_texts):,} docs, dim={corpus_embeddings.shape[1]}")
+
+def _watch_index(interval: float) -> None:
+    """Reload once the watched files have changed and then stayed unchanged for one interval."""
+    previous = failed = None
+    while True:
+        time.sleep(interval)
+        stamp = _watch_stamp()
+        if stamp != snapshot.stamp and stamp == previous and stamp != failed:
+            try:
+                reload_index("index or graph files changed")
+            except Exception:
+                failed = stamp  # retry only after the files change again
+        previous = stamp
 
 # --- LLM SETUP (Qwen via Llama.cpp/GGUF or Transformers) ---
 # Note: For GGUF, you'd typically use llama-cpp-python. 
@@ -96,34 +426,59 @@ print(f"Index ready: {len(doc_texts):,} docs, dim={corpus_embeddings.shape[1]}")
 # Let's try to load Qwen2.5-7B-Instruct via transformers (might be heavy for 8GB if not quantized).
 # To run 4-bit quantized in transformers, we need bitsandbytes.
 
-try:
-    # Fallback to a transformers-loadable model ID if GGUF path isn't valid for this pipeline
-    # "Qwen/Qwen2.5-7B-Instruct" is the repo.
-    # To load in 4-bit:
-    from transformers import BitsAndBytesConfig
-    
-    quantization_config = BitsAndBytesConfig(
-        load_in_4bit=True,
-        bnb_4bit_compute_dtype=torch.float16
-    )
-    
-    tokenizer = AutoTokenizer.from_pretrained("Qwen/Qwen2.5-7B-Instruct")
-    model = AutoModelForCausalLM.from_pretrained(
-        "Qwen/Qwen2.5-7B-Instruct",
-        device_map="auto",
-        quantization_config=quantization_config,
-        trust_remote_code=True,
-    )
+def _load_draft_model(model):
+    """Load DRAFT_MODEL_ID onto the main model's device, or None if it fails."""
+    try:
+        draft = AutoModelForCausalLM.from_pretrained(DRAFT_MODEL_ID).to(device=model.device, dtype=model.dtype)
+        draft.generation_config.num_assistant_tokens = DRAFT_TOKENS
+        print(f"Draft model {DRAFT_MODEL_ID} ready ({DRAFT_TOKENS} speculative tokens).")
+        return draft
+    except Exception as e:
+        print(f"Draft Model Load Error: {e} (continuing with plain decoding)")
+        return None
 
-    llm_pipeline = pipeline("text-generation", model=model, tokenizer=tokenizer, max_new_tokens=512)
-    print("Qwen2.5-7B Ready.")
-except Exception as e:
-    print(f"LLM Load Error: {e}")
-    print("Ensure bitsandbytes is installed: pip install bitsandbytes")
-    llm_pipeline = None
-except Exception as e:
-    print(f"LLM Error: {e}")
-    llm_pipeline = None
+
+def _load_llm():
+    """
+    Load Qwen2.5-7B-Instruct in 4-bit, plus the draft model when configured.
+    Returns (tokenizer, pipeline, draft_model); (None, None, None) if the LLM fails to load.
+    """
+    try:
+        # Fallback to a transformers-loadable model ID if GGUF path isn't valid for this pipeline
+        # "Qwen/Qwen2.5-7B-Instruct" is the repo.
+        # To load in 4-bit:
+        from transformers import BitsAndBytesConfig
+
+        quantization_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_compute_dtype=torch.float16
+        )
+
+        tokenizer = AutoTokenizer.from_pretrained("Qwen/Qwen2.5-7B-Instruct")
+        model = AutoModelForCausalLM.from_pretrained(
+            "Qwen/Qwen2.5-7B-Instruct",
+            device_map="auto",
+            quantization_config=quantization_config,
+            trust_remote_code=True,
+        )
+
+        llm_pipeline = pipeline("text-generation", model=model, tokenizer=tokenizer, max_new_tokens=512)
+        print("Qwen2.5-7B Ready.")
+        draft_model = _load_draft_model(model) if DRAFT_MODEL_ID else None
+        return tokenizer, llm_pipeline, draft_model
+    except Exception as e:
+        print(f"LLM Load Error: {e}")
+        print("Ensure bitsandbytes is installed: pip install bitsandbytes")
+        return None, None, None
+
+
+if RETRIEVAL_ONLY:
+    print("Retrieval-only mode: skipping LLM load (/api/retrieve serves grounded context).")
+    tokenizer, llm_pipeline, draft_model = None, None, None
+elif STUB_MODELS:
+    tokenizer, llm_pipeline, draft_model = StubTokenizer(), StubGenerator(latency_ms=STUB_GENERATE_MS), None
+else:
+    tokenizer, llm_pipeline, draft_model = _load_llm()
 
 # --- 3. RETRIEVAL LOGIC ---
 def _extract_stats(lower_q: str) -> list[str]:
@@ -141,7 +496,7 @@ def _extract_stats(lower_q: str) -> list[str]:
     return stats
 
 
-def structured_retrieve(user_query: str) -> str | None:
+def structured_retrieve(snap: IndexSnapshot, user_query: str) -> str | None:
     """Return grounded context from RDF for question types we can answer exactly."""
     lower_q = user_query.lower()
 
@@ -150,6 +505,24 @@ def structured_retrieve(user_query: str) -> str | None:
         stats = _extract_stats(lower_q)
         if len(stats) >= 2:
             a, b = stats[0], stats[1]
+            if snap.triple_store is not None:
+                er = "http://example.org/elden_ring/"
+                rows = snap.triple_store.query(
+                    [
+                        ("?w", "<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>", "?type"),
+                        ("?w", f"<{er}scaling{a}>", "?valA"),
+                        ("?w", f"<{er}scaling{b}>", "?valB"),
+                        ("?w", "<http://www.w3.org/2000/01/rdf-schema#label>", "?label"),
+                    ],
+                )
+                # Filter and dedup before the limit, as the SPARQL query below does (DISTINCT, FILTER, LIMIT 50).
+                distinct = dict.fromkeys(nt_value(r["?label"]) for r in rows if r["?type"] != f"<{er}WeaponUpgrade>")
+                labels = sorted(list(distinct)[:50])
+                if not labels:
+                    return None
+                bullets = "\n".join([f"- {x}" for x in labels[:25]])
+                return f"Weapons that scale with both {a} and {b}:\n{bullets}"
+
             sparql = f"""
             PREFIX er: <http://example.org/elden_ring/>
             PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
@@ -163,7 +536,7 @@ def structured_retrieve(user_query: str) -> str | None:
             LIMIT 50
             """
             try:
-                rows = list(rdf_graph.query(sparql))
+                rows = list(snap.rdf_graph.query(sparql))
             except Exception as e:
                 print(f"SPARQL Error: {e}")
                 return None
@@ -178,17 +551,91 @@ def structured_retrieve(user_query: str) -> str | None:
     return None
 
 
-def retrieve_and_rerank(user_query):
-    print(f"\nProcessing Query: '{user_query}'")
-    lower_q = user_query.lower()
-    
-    # 1. PARSE STATS
-    required_stats = _extract_stats(lower_q)
+def _aggregate_chunks(snap: IndexSnapshot, hits: list[dict]) -> list[dict]:
+    """Collapse reranked chunk hits (best first) to one hit per parent entity, scored by its best chunk."""
+    entities: dict[str, dict] = {}
+    for hit in hits:
+        subject = snap.doc_subjects[hit['corpus_id']]
+        if subject not in entities:
+            entities[subject] = {
+                'corpus_id': hit['corpus_id'], 'score': hit['score'], 'cross_score': hit['cross_score'],
+                'graph_score': hit.get('graph_score', 0.0), 'chunk_ids': [],
+            }
+        entities[subject]['chunk_ids'].append(hit['corpus_id'])
+    return list(entities.values())
+
+
+def _hit_text(snap: IndexSnapshot, hit: dict) -> str:
+    """
+    Doc text for a hit; for aggregated entities, its matched chunks in order
+    with the title once. Near-duplicate variants collapsed at index time are listed.
+    """
+    chunk_ids = hit.get('chunk_ids')
+    if not chunk_ids or len(chunk_ids) == 1:
+        text = snap.doc_texts[hit['corpus_id']]
+    else:
+        texts = [snap.doc_texts[i] for i in sorted(chunk_ids)]
+        text = texts[0] + "".join("\n" + t.split("\n", 1)[1] for t in texts[1:] if "\n" in t)
+
+    members = snap.clusters.get(snap.doc_subjects[hit['corpus_id']])
+    if members:
+        text += "\nvariants: " + ", ".join(m["title"] for m in members)
+    return text
+
+
+def _neighbour_hits(snap: IndexSnapshot, selected: list[dict], budget: int) -> list[dict]:
+    """
+    Up to `budget` graph neighbours of the selected hits (in rank order) that
+    are not already in the context, as hits carrying a 'relation' line.
+    """
+    if snap.adjacency is None or budget <= 0:
+        return []
+    indptr, indices, predicates = snap.adjacency
+    seen = {snap.doc_subjects[hit['corpus_id']] for hit in selected}
+    n_pred = len(snap.neighbour_predicates)
+    out = []
+    for hit in selected:
+        src = hit['corpus_id']
+        for k in range(int(indptr[src]), int(indptr[src + 1])):
+            nbr = int(indices[k])
+            subject = snap.doc_subjects[nbr]
+            if subject in seen:
+                continue
+            seen.add(subject)
+            code = int(predicates[k])
+            src_title, nbr_title = snap.doc_titles[src], snap.doc_titles[nbr]
+            if code < n_pred:
+                relation = f"{src_title} {snap.neighbour_predicates[code]} {nbr_title}"
+            else:
+                relation = f"{nbr_title} {snap.neighbour_predicates[code - n_pred]} {src_title}"
+            # An entity's chunks are consecutive and edges point at its first one.
+            end = nbr + 1
+            while snap.chunked and end < len(snap.doc_subjects) and snap.doc_subjects[end] == subject:
+                end += 1
+            out.append({'corpus_id': nbr, 'chunk_ids': list(range(nbr, end)), 'relation': relation})
+            if len(out) >= budget:
+                return out
+    return out
+
+
+def _context(snap: IndexSnapshot, selected: list[dict], neighbours: list[dict]) -> str | None:
+    parts = [_hit_text(snap, hit) for hit in selected]
+    parts += [f"Related ({hit['relation']}):\n{_hit_text(snap, hit)}" for hit in neighbours]
+    return "\n\n".join(parts) or None
 
-    # 2. STANDARD SEMANTIC SEARCH
-    query_embedding = bi_encoder.encode(user_query, convert_to_tensor=True, normalize_embeddings=True)
-    hits = util.semantic_search(query_embedding, corpus_embeddings, top_k=200 if len(required_stats) > 1 else 50)[0]
 
+def _entity_text(snap: IndexSnapshot, doc_id: int) -> str:
+    """Text of every chunk of doc_id's entity; chunks of one entity are consecutive docs."""
+    subject = snap.doc_subjects[doc_id]
+    first = last = doc_id
+    while first > 0 and snap.doc_subjects[first - 1] == subject:
+        first -= 1
+    while last + 1 < len(snap.doc_subjects) and snap.doc_subjects[last + 1] == subject:
+        last += 1
+    return "\n".join(snap.doc_texts[i] for i in range(first, last + 1))
+
+
+def _dual_stat_filter(snap: IndexSnapshot, hits: list[dict], required_stats: list[str]) -> list[dict]:
     # 3. OPTIONAL DUAL-STAT FILTER
     # The old approach used intersection of two synthetic searches, which often returns 0.
     # Instead, we retrieve normally and then filter candidates by presence of both stats tokens.
@@ -202,7 +649,8 @@ def retrieve_and_rerank(user_query):
 
         filtered = []
         for hit in hits:
-            text = doc_texts[hit['corpus_id']]
+            # A chunk may hold only some of its entity's scaling lines; test the whole entity.
+            text = _entity_text(snap, hit['corpus_id']) if snap.chunked else snap.doc_texts[hit['corpus_id']]
             # Check if text contains scaling info for both stats
             # Simple text check: "scalingStrength" and "scalingDexterity"
             if all((f"scaling{stat}" in text) for stat in required_stats):
@@ -216,25 +664,25 @@ def retrieve_and_rerank(user_query):
         else:
             print("   No strict dual-stat matches; falling back to semantic search results.")
 
-    if not hits:
-        return None
+    return hits
 
-    # 3. RERANKING
-    cross_inp = [[user_query, doc_texts[hit['corpus_id']]] for hit in hits]
-    cross_scores = cross_encoder.predict(cross_inp)
-    
-    for idx in range(len(cross_scores)):
-        hits[idx]['cross_score'] = cross_scores[idx]
-        
+
+def _select_hits(snap: IndexSnapshot, lower_q: str, hits: list[dict]) -> tuple[list[dict], bool]:
+    """
+    Order reranked hits and keep up to 5 distinct, relevant ones for the
+    context. The flag is True when no hit passed the reranker threshold and
+    the top hits were kept anyway.
+    """
     hits = sorted(hits, key=lambda x: x['cross_score'], reverse=True)
+    if snap.chunked:
+        hits = _aggregate_chunks(snap, hits)
     
     results = []
     seen_names = set()
     
     for hit in hits:
         score = hit['cross_score']
-        content = doc_texts[hit['corpus_id']]
-        name = docs[hit['corpus_id']].get("title") or content.split("\n", 1)[0]
+        name = snap.doc_titles[hit['corpus_id']] or snap.doc_texts[hit['corpus_id']].split("\n", 1)[0]
         
         # Heuristic: If asking for weapon, ignore Seals/Staffs
         if "weapon" in lower_q and ("Seal" in name or "Staff" in name):
@@ -243,29 +691,235 @@ def retrieve_and_rerank(user_query):
         # Lowered Threshold to -4.0 to guarantee debug output
         if score > -4.0 and name not in seen_names:
             print(f"   MATCH ({score:.2f}): {name}") # Log to terminal
-            results.append(content)
+            results.append(hit)
             seen_names.add(name)
             
         if len(results) >= 5: break
 
     # Fallback: if reranker scores are all low, still return top-N hits.
     if not results:
-        for hit in hits[:5]:
-            content = doc_texts[hit['corpus_id']]
-            results.append(content)
+        return hits[:5], True
+    return results, False
 
-    if not results:
-        return None
-    return "\n\n".join(results)
 
-def generate_answer(context, query):
-    if not llm_pipeline: return "LLM not loaded."
+embedding_cache = LRUCache(EMBED_CACHE_SIZE)
+context_cache = LRUCache(CONTEXT_CACHE_SIZE)
+
+
+def encode_queries(user_queries: list[str]) -> torch.Tensor:
+    """Normalized bi-encoder embeddings, one row per query; repeated queries come from embedding_cache."""
+    keys = [normalize_query(q) for q in user_queries]
+    rows = [embedding_cache.get(key) for key in keys]
+    missing = [i for i, row in enumerate(rows) if row is None]
+    if missing:
+        encoded = bi_encoder.encode(
+            [user_queries[i] for i in missing], convert_to_tensor=True, normalize_embeddings=True, batch_size=ENCODE_BATCH_SIZE
+        )
+        for i, row in zip(missing, encoded):
+            rows[i] = row.clone()  # don't pin the whole batch tensor in the cache
+            embedding_cache.put(keys[i], rows[i])
+    return torch.stack(rows)
+
+
+def _semantic_search(snap: IndexSnapshot, query_embeddings: torch.Tensor, top_k: int) -> list[list[dict]]:
+    """Bi-encoder top-k per query; through the reduced tier when one is loaded."""
+    if snap.reduced is None:
+        return util.semantic_search(query_embeddings, snap.corpus_embeddings, top_k=top_k)
+    ids, scores = pca_search(
+        query_embeddings.cpu().numpy(), snap.corpus_embeddings_cpu.numpy(), top_k, snap.reduced, SEARCH_POOL * top_k
+    )
+    return [
+        [{'corpus_id': int(i), 'score': float(score)} for i, score in zip(row_ids, row_scores)]
+        for row_ids, row_scores in zip(ids, scores)
+    ]
+
+
+def _graph_boost(
+    snap: IndexSnapshot, query_embeddings: torch.Tensor, all_hits: list[list[dict]], top_ks: list[int]
+) -> list[list[dict]]:
+    """
+    Re-order each query's bi-encoder candidates (best first) by score plus
+    PPR_WEIGHT x personalized PageRank mass from its top hits, and keep its
+    top_k. Docs strongly linked to the top hits but outside the candidates
+    join the pool first. Each hit gets a 'graph_score' in [0, 1].
+    """
+    seeds = seed_matrix(
+        snap.walk.shape[0],
+        [[(hit['corpus_id'], max(float(hit['score']), 0.0) + 1e-6) for hit in hits[:PPR_SEEDS]] for hits in all_hits],
+    )
+    mass = personalized_pagerank(snap.walk, seeds, PPR_RESTART, PPR_ITERATIONS)
+
+    boosted = []
+    for q, (hits, top_k) in enumerate(zip(all_hits, top_ks)):
+        ids = mass.indices[mass.indptr[q]:mass.indptr[q + 1]]
+        values = mass.data[mass.indptr[q]:mass.indptr[q + 1]]
+        if not len(values) or values.max() <= 0:
+            boosted.append(hits[:top_k])
+            continue
+        values = values / values.max()
+        known = {hit['corpus_id'] for hit in hits}
+        order = np.argsort(-values)[:len(known) + PPR_EXPAND]
+        new_ids = [int(i) for i in ids[order] if int(i) not in known][:PPR_EXPAND]
+        if new_ids:
+            query = query_embeddings[q].to(snap.corpus_embeddings.device)
+            scores = (snap.corpus_embeddings[new_ids] @ query).tolist()
+            hits = hits + [{'corpus_id': i, 'score': score} for i, score in zip(new_ids, scores)]
+        hit_ids = np.array([hit['corpus_id'] for hit in hits])
+        pos = np.minimum(np.searchsorted(ids, hit_ids), len(ids) - 1)
+        graph = np.where(ids[pos] == hit_ids, values[pos], 0.0)
+        for hit, g in zip(hits, graph.tolist()):
+            hit['graph_score'] = g
+        hits.sort(key=lambda hit: hit['score'] + PPR_WEIGHT * hit['graph_score'], reverse=True)
+        boosted.append(hits[:top_k])
+    return boosted
+
+
+def _cross_scores(snap: IndexSnapshot, user_queries: list[str], all_hits: list[list[dict]]) -> np.ndarray:
+    """
+    Cross-encoder score of every (query, hit) pair, in query then hit order.
+    With the index's pre-tokenized docs only the queries are tokenized; the
+    pairs are assembled from token ids and run in length-bucketed batches.
+    """
+    if snap.rerank_tokens is None or pair_template is None:
+        cross_inp = [[q, snap.doc_texts[hit['corpus_id']]] for q, hits in zip(user_queries, all_hits) for hit in hits]
+        return cross_encoder.predict(cross_inp, batch_size=RERANK_BATCH_SIZE) if cross_inp else np.zeros(0, dtype=np.float32)
+
+    tokens, offsets = snap.rerank_tokens
+    query_ids = cross_encoder.tokenizer(user_queries, add_special_tokens=False)["input_ids"]
+    pairs = [
+        (np.asarray(ids), tokens[offsets[hit['corpus_id']]:offsets[hit['corpus_id'] + 1]])
+        for ids, hits in zip(query_ids, all_hits)
+        for hit in hits
+    ]
+    scores = np.zeros(len(pairs), dtype=np.float32)
+    model = cross_encoder.model
+    use_types = "token_type_ids" in cross_encoder.tokenizer.model_input_names
+    with torch.inference_mode():
+        for positions, input_ids, token_types, mask in pair_template.batches(pairs, pair_max_length, RERANK_BATCH_SIZE):
+            inputs = {"input_ids": input_ids, "attention_mask": mask}
+            if use_types:
+                inputs["token_type_ids"] = token_types
+            logits = model(**{k: torch.from_numpy(v).to(model.device) for k, v in inputs.items()}).logits.squeeze(-1)
+            scores[positions] = cross_encoder.activation_fn(logits).float().cpu().numpy()
+    return scores
+
+
+def rerank_batch(
+    snap: IndexSnapshot,
+    user_queries: list[str],
+    query_embeddings: torch.Tensor | None = None,
+) -> list[tuple[list[dict], bool]]:
+    """
+    Retrieve and rerank several queries at once: one bi-encoder encode, one
+    top-k search over the corpus matrix for all queries, and every
+    (query, doc) pair packed into shared cross-encoder predict batches.
+    Returns (selected hits, fallback flag) per query, as from _select_hits.
+    Pass query_embeddings when the queries were already encoded.
+    """
+    lower_qs = [q.lower() for q in user_queries]
+
+    # 1. PARSE STATS
+    required_stats = [_extract_stats(lower_q) for lower_q in lower_qs]
+    top_ks = [200 if len(stats) > 1 else 50 for stats in required_stats]
+
+    # 2. STANDARD SEMANTIC SEARCH
+    if query_embeddings is None:
+        query_embeddings = encode_queries(user_queries)
+    all_hits = _semantic_search(snap, query_embeddings, max(top_ks))
+    if snap.walk is not None:
+        all_hits = _graph_boost(snap, query_embeddings, all_hits, top_ks)
+    all_hits = [_dual_stat_filter(snap, hits[:k], stats) for hits, k, stats in zip(all_hits, top_ks, required_stats)]
+
+    # 3. RERANKING (pairs from every query share predict batches)
+    cross_scores = _cross_scores(snap, user_queries, all_hits)
+
+    offset = 0
+    for hits in all_hits:
+        for hit in hits:
+            hit['cross_score'] = cross_scores[offset]
+            offset += 1
+
+    return [_select_hits(snap, lower_q, hits) if hits else ([], False) for lower_q, hits in zip(lower_qs, all_hits)]
+
+
+def retrieve_and_rerank_batch(
+    snap: IndexSnapshot,
+    user_queries: list[str],
+    query_embeddings: torch.Tensor | None = None,
+    neighbour_budget: int = NEIGHBOUR_BUDGET,
+) -> list[str | None]:
+    """
+    Grounded context per query, selected docs then graph neighbours (None
+    when nothing was retrieved). Contexts for queries seen before at this
+    budget and index version come from context_cache.
+    """
+    keys = [(normalize_query(q), neighbour_budget, snap.version) for q in user_queries]
+    contexts = [context_cache.get(key) for key in keys]
+    missing = [i for i, context in enumerate(contexts) if context is None]
+    if missing:
+        embeddings = query_embeddings[missing] if query_embeddings is not None else None
+        for i, (selected, _) in zip(missing, rerank_batch(snap, [user_queries[i] for i in missing], embeddings)):
+            contexts[i] = _context(snap, selected, _neighbour_hits(snap, selected, neighbour_budget))
+            context_cache.put(keys[i], contexts[i])
+    return contexts
+
+
+def retrieve_and_rerank(
+    snap: IndexSnapshot,
+    user_query,
+    query_embedding: torch.Tensor | None = None,
+    neighbour_budget: int = NEIGHBOUR_BUDGET,
+):
+    print(f"\nProcessing Query: '{user_query}'")
+    embeddings = query_embedding.unsqueeze(0) if query_embedding is not None else None
+    return retrieve_and_rerank_batch(snap, [user_query], embeddings, neighbour_budget)[0]
+
+
+answer_cache = SemanticCache(CACHE_SIZE, CACHE_THRESHOLD)
+answer_cache.set_version(snapshot.version)  # and again by reload_index on every swap
+
+GENERATION_FAILED = "I couldn't generate a full response due to an LLM runtime error. "
+
+
+def _answer_cacheable(query: str) -> bool:
+    """
+    Dual-stat queries are filtered by the stats they name (_dual_stat_filter), which
+    their embeddings barely tell apart, so the semantic cache would mix them up.
+    """
+    return len(_extract_stats(query.lower())) < 2
+
+
+def _cache_answer(snap: IndexSnapshot, embedding: torch.Tensor, context: str, answer: str) -> None:
+    # Without an LLM, generate_answer returns a placeholder; only real answers are cached.
+    if llm_pipeline and not answer.startswith(GENERATION_FAILED):
+        answer_cache.put(embedding.cpu().numpy(), context, answer, snap.version)
+
+
+class _CallbackStreamer(TextStreamer):
+    """Hands each finalized piece of generated text to on_text."""
+
+    def __init__(self, tokenizer, on_text):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.on_text = on_text
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self.on_text(text)
+
+
+def generate_answer(context, query, on_text=None):
+    """on_text, if given, is called (on the generating thread) with each piece of the answer as it is decoded."""
+    if not llm_pipeline:
+        return "Retrieval-only mode: no answer generated." if RETRIEVAL_ONLY else "LLM not loaded."
     
     messages = [
         {"role": "system", "content": "You are Melina, a helpful guide in Elden Ring. Use the provided Data Context to answer the user's question accurately. If the context contains stats or lists, format them clearly. If the answer is not in the context, say so."},
         {"role": "user", "content": f"Data Context:\n{context}\n\nQuestion: {query}"}
     ]
     prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    generate_kwargs = {"assistant_model": draft_model} if draft_model is not None else {}
+    if on_text is not None:
+        generate_kwargs["streamer"] = _CallbackStreamer(tokenizer, on_text)
     try:
         outputs = llm_pipeline(
             prompt,
@@ -273,6 +927,7 @@ def generate_answer(context, query):
             temperature=0.3, # Lower temp for more factual answers
             top_p=0.9,
             # use_cache=True is usually fine for Qwen
+            **generate_kwargs,
         )
         # Qwen chat template usually ends with <|im_start|>assistant
         # But pipeline output includes the prompt. We need to strip it.
@@ -286,24 +941,490 @@ def generate_answer(context, query):
     except Exception as e:
         # Never hard-fail the API route on generation; return grounded context instead.
         print(f"LLM Generation Error: {e}")
-        return (
-            "I couldn't generate a full response due to an LLM runtime error. "
-            "Here is the most relevant context I found:\n\n" + context
-        )
+        return GENERATION_FAILED + "Here is the most relevant context I found:\n\n" + context
 
 # --- ROUTES ---
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
-@app.post("/api/chat")
-async def chat(request: QueryModel):
-    context = structured_retrieve(request.query) or retrieve_and_rerank(request.query)
+# One LLM, so one generation worker.
+rerank_queue = StageQueue("rerank", RERANK_WORKERS, RERANK_QUEUE, FAST_QUEUE)
+llm_queue = StageQueue("llm", 1, LLM_QUEUE, FAST_QUEUE)
+
+
+def _busy(e: QueueFull) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=f"Server busy: the {e.stage} queue is full.",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+async def _stage(queue: StageQueue, fast: bool, fn, *args):
+    """Run a blocking stage on the queue's workers; a full queue becomes a 503 with Retry-After."""
+    try:
+        return await queue.run(fn, *args, fast=fast)
+    except QueueFull as e:
+        raise _busy(e)
+
+
+async def _inline(queue: StageQueue, fast: bool, fn, *args):
+    """_stage without the queue: runs fn on the calling thread (used when profiling, see _profiled_chat)."""
+    return fn(*args)
+
+
+def _run_inline(coro):
+    """Drive a coroutine that never suspends (every stage is _inline) to completion."""
+    try:
+        coro.send(None)
+    except StopIteration as done:
+        return done.value
+    coro.close()
+    raise RuntimeError("coroutine suspended")
+
+
+async def _chat(request: QueryModel, stage=_stage, events: Broadcast | None = None) -> dict:
+    # Structured answers depend on exact stat values in the query, so only the semantic path is cached,
+    # and only at the default neighbour budget (the cache key is the query alone).
+    snap = snapshot
+    # Graph lookups (SPARQL on the rdflib backend) can be slow; they run in the rerank fast lane.
+    context = await stage(rerank_queue, True, structured_retrieve, snap, request.query)
+    structured = bool(context)
+    embedding = None
+    use_cache = request.neighbours is None and _answer_cacheable(request.query)
+    if not context:
+        embedding = (await stage(rerank_queue, True, encode_queries, [request.query]))[0]
+        cached = answer_cache.get(embedding.cpu().numpy(), snap.version) if use_cache else None
+        if cached:
+            context, ai_response, similarity = cached
+            return {"context": context, "response": ai_response, "cached": True, "similarity": similarity}
+        if stage is _stage and llm_pipeline:
+            # Don't spend a rerank on a request the LLM queue would turn away.
+            try:
+                llm_queue.check()
+            except QueueFull as e:
+                raise _busy(e)
+        budget = NEIGHBOUR_BUDGET if request.neighbours is None else request.neighbours
+        context = await stage(rerank_queue, False, retrieve_and_rerank, snap, request.query, embedding, budget)
     if not context:
         return {"context": "No data found.", "response": "The Archives are silent on this matter."}
-    
-    ai_response = generate_answer(context, request.query)
+
+    on_text = None
+    if events is not None:
+        events.publish({"context": context})
+        loop = asyncio.get_running_loop()
+        on_text = lambda text: loop.call_soon_threadsafe(events.publish, {"delta": text})
+    if llm_pipeline:
+        ai_response = await stage(llm_queue, structured, generate_answer, context, request.query, on_text)
+    else:
+        ai_response = generate_answer(context, request.query)  # placeholder; nothing to queue for
+    if embedding is not None and use_cache:
+        _cache_answer(snap, embedding, context, ai_response)
     return {"context": context, "response": ai_response}
 
+
+# Identical questions (same normalized query, neighbour budget and index version) that arrive while
+# one is being answered wait for that answer instead of running the pipeline again.
+chat_flights = SingleFlight()
+stream_flights = SingleFlight()
+
+
+def _flight_key(request: QueryModel) -> tuple:
+    return normalize_query(request.query), request.neighbours, snapshot.version
+
+
+@app.post("/api/chat")
+async def chat(request: QueryModel, profile: bool = False, x_profile: str | None = Header(default=None)):
+    query_log.record(normalize_query(request.query))
+    if not (profile or x_profile == "1"):
+        return await chat_flights.run(_flight_key(request), lambda: _chat(request))
+    result, summary = await _stage(llm_queue, False, _profiled_chat, request)
+    return {**result, "profile": summary}
+
+
+def _profiled_chat(request: QueryModel) -> tuple[dict, dict]:
+    """
+    _chat under cProfile, on an LLM worker thread. cProfile only sees the calling
+    thread, so every stage runs inline there; the job holds the LLM worker for the
+    whole request, so it still never generates alongside another request and is
+    subject to the LLM queue's limits, and the event loop stays free.
+    """
+    return profile_call(
+        _run_inline, _chat(request, _inline), stages=PROFILE_STAGES, out_dir=PROFILE_DIR, keep=PROFILE_KEEP
+    )
+
+
+def _retrieve_hits(snap: IndexSnapshot, query: str, budget: int) -> tuple[list[dict], bool, list[dict]]:
+    selected, fallback = rerank_batch(snap, [query])[0]
+    return selected, fallback, _neighbour_hits(snap, selected, budget)
+
+
+async def _chat_events(request: QueryModel, events: Broadcast) -> None:
+    result = await _chat(request, events=events)
+    if not events.events:
+        events.publish({"context": result["context"]})
+    events.publish({"done": True, **result})
+
+
+async def _ndjson(events: Broadcast):
+    try:
+        async for event in events.subscribe():
+            yield json.dumps(event) + "\n"
+    except HTTPException as e:
+        yield json.dumps({"error": e.detail, "status": e.status_code}) + "\n"
+    except Exception as e:
+        # The status line was sent with the first event; end the body with an error line instead of truncating it.
+        print(f"Chat stream failed: {type(e).__name__}: {e}")
+        yield json.dumps({"error": "Internal Server Error", "status": 500}) + "\n"
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: QueryModel):
+    """
+    /api/chat as newline-delimited JSON: {"context"}, then {"delta"} pieces of
+    the answer as they are generated, then {"done": true} with the full result.
+    Identical concurrent requests share one generation; late joiners replay
+    the events so far. Errors before the first event are returned as HTTP
+    errors, later ones as an {"error"} line.
+    """
+    query_log.record(normalize_query(request.query))
+    events = stream_flights.stream(_flight_key(request), lambda broadcast: _chat_events(request, broadcast))
+    # Wait for the first event so that admission failures still get a real status code.
+    first = events.subscribe()
+    try:
+        await first.__anext__()
+    except StopAsyncIteration:
+        pass
+    finally:
+        await first.aclose()
+    return StreamingResponse(_ndjson(events), media_type="application/x-ndjson")
+
+
+@app.post("/api/retrieve")
+async def retrieve(request: QueryModel):
+    """Grounded context without generation, plus which path answered and the per-hit scores."""
+    snap = snapshot
+    context = await _stage(rerank_queue, True, structured_retrieve, snap, request.query)
+    if context:
+        return {"query": request.query, "path": "structured", "context": context, "hits": []}
+
+    print(f"\nProcessing Query: '{request.query}'")
+    budget = NEIGHBOUR_BUDGET if request.neighbours is None else request.neighbours
+    selected, fallback, neighbours = await _stage(rerank_queue, False, _retrieve_hits, snap, request.query, budget)
+    hits = [
+        {
+            "subject": snap.doc_subjects[hit['corpus_id']],
+            "title": snap.doc_titles[hit['corpus_id']],
+            "bi_score": float(hit['score']),
+            "cross_score": float(hit['cross_score']),
+            "graph_score": float(hit.get('graph_score', 0.0)),
+        }
+        for hit in selected
+    ]
+    if not selected:
+        path = "none"
+    elif fallback:
+        path = "semantic_fallback"
+    else:
+        path = "semantic"
+    related = [
+        {"subject": snap.doc_subjects[hit['corpus_id']], "title": snap.doc_titles[hit['corpus_id']], "relation": hit['relation']}
+        for hit in neighbours
+    ]
+    context = _context(snap, selected, neighbours) or "No data found."
+    return {"query": request.query, "path": path, "context": context, "hits": hits, "neighbours": related}
+
+
+def _structured_many(snap: IndexSnapshot, queries: list[str]) -> list[str | None]:
+    return [structured_retrieve(snap, q) for q in queries]
+
+
+def _generate_many(items: list[tuple[str, str]]) -> list[str]:
+    return [generate_answer(context, query) for context, query in items]
+
+
+@app.post("/api/batch")
+async def batch(request: BatchQueryModel):
+    """Answer many queries in one call; retrieval and reranking are batched across them."""
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_QUERIES} queries per batch.")
+
+    for query in request.queries:
+        query_log.record(normalize_query(query))
+    snap = snapshot
+    contexts = await _stage(rerank_queue, True, _structured_many, snap, request.queries)
+    cached = {}
+    embeddings = {}
+    pending = [i for i, context in enumerate(contexts) if not context]
+    if pending:
+        query_embeddings = await _stage(rerank_queue, False, encode_queries, [request.queries[i] for i in pending])
+        if request.generate and request.neighbours is None:
+            # Answers are only cached for generated responses; skip those from reranking too.
+            for i, embedding in zip(pending, query_embeddings):
+                if not _answer_cacheable(request.queries[i]):
+                    continue
+                embeddings[i] = embedding
+                hit = answer_cache.get(embedding.cpu().numpy(), snap.version)
+                if hit:
+                    cached[i] = hit
+            misses = [j for j, i in enumerate(pending) if i not in cached]
+            pending, query_embeddings = [pending[j] for j in misses], query_embeddings[misses]
+        if pending:
+            queries = [request.queries[i] for i in pending]
+            budget = NEIGHBOUR_BUDGET if request.neighbours is None else request.neighbours
+            reranked = await _stage(rerank_queue, False, retrieve_and_rerank_batch, snap, queries, query_embeddings, budget)
+            for i, context in zip(pending, reranked):
+                contexts[i] = context
+
+    responses = {}
+    to_generate = [i for i, context in enumerate(contexts) if context and i not in cached] if request.generate else []
+    if to_generate:
+        items = [(contexts[i], request.queries[i]) for i in to_generate]
+        # The whole batch is one job in the LLM queue, so it cannot take every slot.
+        answers = await _stage(llm_queue, False, _generate_many, items) if llm_pipeline else _generate_many(items)
+        responses = dict(zip(to_generate, answers))
+
+    results = []
+    for i, (query, context) in enumerate(zip(request.queries, contexts)):
+        if i in cached:
+            context, response, similarity = cached[i]
+            results.append({"query": query, "context": context, "response": response, "cached": True, "similarity": similarity})
+            continue
+        result = {"query": query, "context": context or "No data found."}
+        if request.generate:
+            result["response"] = responses.get(i, "The Archives are silent on this matter.")
+            if context and i in embeddings:
+                _cache_answer(snap, embeddings[i], context, result["response"])
+        results.append(result)
+    return {"results": results}
+
+
+@app.get("/api/cache")
+async def cache_stats():
+    """Semantic answer cache size, hit rate and invalidation counters."""
+    return answer_cache.stats()
+
+
+def _check_admin(token: str | None) -> None:
+    if ADMIN_TOKEN and token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+
+def _version_report() -> dict:
+    snap = snapshot
+    return {
+        "version": snap.version,
+        "created_at": snap.meta.get("created_at"),
+        "doc_count": len(snap.doc_texts),
+        "loaded_at": int(snap.loaded_at),
+        "pid": os.getpid(),
+        **reload_status,
+    }
+
+
+@app.get("/api/admin/version")
+async def admin_version(x_admin_token: str | None = Header(default=None)):
+    """The index and graph version this worker is serving."""
+    _check_admin(x_admin_token)
+    return _version_report()
+
+
+@app.post("/api/admin/reload")
+async def admin_reload(x_admin_token: str | None = Header(default=None)):
+    """
+    Reload the index and graph now. Loading runs off the event loop, so
+    requests keep being served from the old version until the swap. With
+    pre-forked workers only the worker serving this call reloads; the others
+    pick the rebuild up through their file watchers.
+    """
+    _check_admin(x_admin_token)
+    try:
+        await asyncio.to_thread(reload_index, "admin request")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed: {e}")
+    return _version_report()
+
+
+# Event-loop lag: how late a timer scheduled every LAG_INTERVAL_MS actually fires.
+# Blocking work inside async handlers shows up here as lag for every other request.
+loop_lag_ms: deque[float] = deque(maxlen=4096)
+
+
+async def _sample_loop_lag() -> None:
+    interval = LAG_INTERVAL_MS / 1000
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        loop_lag_ms.append(max(0.0, (time.perf_counter() - start - interval) * 1000))
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+@app.get("/api/metrics")
+async def metrics(reset: bool = False):
+    """
+    Event-loop lag percentiles, admission queue depths and wait times, cache
+    counters and the last cache warm-up for this worker; reset=1 clears the
+    lag samples and the queue counters.
+    """
+    lags = sorted(loop_lag_ms)
+    report = {
+        "pid": os.getpid(),
+        "event_loop_lag_ms": {
+            "samples": len(lags),
+            "p50": round(_percentile(lags, 0.50), 3),
+            "p99": round(_percentile(lags, 0.99), 3),
+            "max": round(lags[-1], 3) if lags else 0.0,
+        },
+        "queues": {queue.name: queue.stats() for queue in (rerank_queue, llm_queue)},
+        "coalescing": {"chat": chat_flights.stats(), "stream": stream_flights.stats()},
+        "cache": answer_cache.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "context_cache": context_cache.stats(),
+        "warm": warm_status,
+    }
+    if reset:
+        loop_lag_ms.clear()
+        rerank_queue.reset()
+        llm_queue.reset()
+    return report
+
+
+@app.on_event("startup")
+async def _start_loop_lag_sampler():
+    if LAG_INTERVAL_MS > 0:
+        app.state.lag_task = asyncio.create_task(_sample_loop_lag())
+
+
+@app.on_event("startup")
+async def _start_stage_queues():
+    # Per server process, like the index watcher below.
+    rerank_queue.start()
+    llm_queue.start()
+
+
+query_log = QueryLog(QUERY_LOG_PATH, QUERY_LOG_MAX)
+warm_status = {"running": False, "reason": None, "queries": 0, "warmed": 0, "seconds": None}
+_server_loop: asyncio.AbstractEventLoop | None = None
+_warm_task: asyncio.Task | None = None
+
+
+async def _warm_caches(reason: str) -> None:
+    """Replay the most frequent logged queries through retrieval (and generation) while the server is idle."""
+    queries = await asyncio.to_thread(query_log.top, WARM_TOP)
+    warm_status.update(running=True, reason=reason, queries=len(queries), warmed=0, seconds=None)
+    print(f"Warming caches with {len(queries)} logged queries ({reason})...")
+    start = time.perf_counter()
+    try:
+        for query in queries:
+            while rerank_queue.backlog() or llm_queue.backlog():
+                await asyncio.sleep(WARM_INTERVAL_MS / 1000 or 0.01)
+            snap = snapshot
+            try:
+                if await rerank_queue.run(structured_retrieve, snap, query, fast=True):
+                    continue  # answered from the graph; nothing to cache
+                embedding = (await rerank_queue.run(encode_queries, [query]))[0]
+                context = await rerank_queue.run(retrieve_and_rerank, snap, query, embedding, NEIGHBOUR_BUDGET)
+                if WARM_GENERATE and context and llm_pipeline and _answer_cacheable(query):
+                    answer = await llm_queue.run(generate_answer, context, query)
+                    _cache_answer(snap, embedding, context, answer)
+            except QueueFull:
+                continue  # traffic arrived; the next query waits for idle again
+            warm_status["warmed"] += 1
+            await asyncio.sleep(WARM_INTERVAL_MS / 1000)
+    finally:
+        warm_status.update(running=False, seconds=round(time.perf_counter() - start, 3))
+    print(f"Warmed {warm_status['warmed']} queries in {warm_status['seconds']:.1f}s")
+
+
+def _start_warm(reason: str) -> None:
+    global _warm_task
+    if _warm_task is not None:
+        _warm_task.cancel()  # warming for an older version
+    _warm_task = asyncio.ensure_future(_warm_caches(reason))
+
+
+def _schedule_warm(reason: str) -> None:
+    """Start a cache warm-up on the server loop; callable from any thread."""
+    if WARM_TOP > 0 and _server_loop is not None:
+        _server_loop.call_soon_threadsafe(_start_warm, reason)
+
+
+async def _flush_query_log() -> None:
+    while True:
+        await asyncio.sleep(QUERY_LOG_FLUSH)
+        await asyncio.to_thread(query_log.flush)
+
+
+@app.on_event("startup")
+async def _start_query_log():
+    global _server_loop
+    _server_loop = asyncio.get_running_loop()
+    if QUERY_LOG_FLUSH > 0:
+        app.state.query_log_task = asyncio.create_task(_flush_query_log())
+    _schedule_warm("startup")
+
+
+@app.on_event("shutdown")
+async def _stop_query_log():
+    query_log.flush()
+
+
+@app.on_event("startup")
+async def _start_index_watcher():
+    # Started per server process (after fork), since threads do not survive fork().
+    if RELOAD_INTERVAL > 0:
+        threading.Thread(target=_watch_index, args=(RELOAD_INTERVAL,), name="index-watcher", daemon=True).start()
+
+print(f"Startup memory (pid {os.getpid()}): {_memory_report()}")
+
+
+def _serve_prefork(host: str, port: int, workers: int) -> None:
+    """
+    Bind once, then fork `workers` uvicorn servers from this process. Models
+    and indexes were loaded at import, so children share them copy-on-write
+    (mmapped index and graph files are shared through the page cache).
+    """
+    if torch.cuda.is_initialized():
+        raise RuntimeError("Pre-fork workers cannot share a CUDA context; run one worker per GPU instead.")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    # Keep the loaded objects out of future GC passes so children don't dirty (copy) their pages.
+    gc.freeze()
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            torch.set_num_threads(threads)
+            print(f"Worker {os.getpid()} memory: {_memory_report()}")
+            uvicorn.Server(uvicorn.Config(app, host=host, port=port)).run(sockets=[sock])
+            os._exit(0)
+        children.append(pid)
+
+    print(f"Serving on http://{host}:{port} with {workers} pre-forked workers")
+    for pid in children:
+        while True:
+            try:
+                os.waitpid(pid, 0)
+                break
+            except KeyboardInterrupt:
+                continue  # children receive the same SIGINT and shut down on their own
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if WORKERS > 1:
+        _serve_prefork("0.0.0.0", PORT, WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=PORT)
\ No newline at end of file